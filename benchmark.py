@@ -0,0 +1,295 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import pandas as pd
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    from . import priceguide
+except ImportError:
+    import priceguide
+
+RESULTS_DIR = Path(__file__).parent / "benchmarks"
+
+# The steps of calculate() that get their own timings. Stages can nest
+# (adjust_by_pos runs inside build_values), so each time is inclusive.
+STAGES = [
+    "load_extra",
+    "load_games_by_pos",
+    "build_values",
+    "build_values_np",
+    "adjust_by_pos",
+    "assign_slots",
+    "render_positions",
+    "calc_dollar_values",
+    "format_final_columns",
+]
+
+# Synthetic copies of the latest season, to show anything that grows
+# faster than the number of players
+SCALES = (10, 100)
+SCALE_LEAGUES = [priceguide.League.LEAGUE_STANDARD_5x5, priceguide.League.LEAGUE_CBS_POINTS]
+
+# Copies of a player get their own ids, this far apart
+ID_STRIDE = 10**6
+
+# How far a copied player's stats can drift from the original
+SCALE_SPREAD = 0.2
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Time priceguide on the bundled seasons")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case; the min and median are kept")
+    parser.add_argument("--engines", nargs="+", default=[priceguide.ENGINE_PANDAS, priceguide.ENGINE_NUMPY])
+    parser.add_argument("--solvers", nargs="+", default=[priceguide.SLOT_GREEDY, priceguide.SLOT_OPTIMAL])
+    parser.add_argument("--leagues", nargs="+", default=league_presets())
+    parser.add_argument("--years", nargs="+", type=int, default=priceguide.data_years())
+    parser.add_argument("--scales", nargs="*", type=int, default=list(SCALES))
+    parser.add_argument("--output", type=Path, help="where to write the results (default benchmarks/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="compare two results files instead")
+    args = parser.parse_args()
+
+    if args.compare:
+        print_comparison(json.loads(args.compare[0].read_text()), json.loads(args.compare[1].read_text()))
+        return
+
+    results = run_all(args.leagues, args.years, args.engines, args.solvers, args.scales, args.repeat)
+    print_solvers(results)
+
+    output = args.output or RESULTS_DIR / (results["commit"] + ".json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1))
+    print("Wrote", output)
+
+def league_presets():
+    return [value for name, value in vars(priceguide.League).items() if name.startswith("LEAGUE_")]
+
+def run_all(leagues, years, engines, solvers, scales, repeat):
+
+    results = {}
+    results["commit"] = current_commit()
+    results["created"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    results["python"] = platform.python_version()
+    results["pandas"] = pd.__version__
+    results["numpy"] = np.__version__
+    results["repeat"] = repeat
+    results["loads"] = []
+    results["cases"] = []
+
+    for year in years:
+        results["loads"].append(bench_load(year, repeat))
+
+        hitters, pitchers = load_season(year)
+        for league in leagues:
+            for engine in engines:
+                for solver in solvers:
+                    case = bench_case(league, year, engine, solver, hitters, pitchers, repeat)
+                    results["cases"].append(case)
+                    print_case(case)
+
+    if scales and years:
+        year = max(years)
+        hitters, pitchers = load_season(year)
+        gbp = priceguide.games_by_pos(year)
+        for scale in scales:
+            rng = np.random.default_rng(scale)
+            scaled_hitters = scaled_stats(hitters, scale, rng)
+            scaled_pitchers = scaled_stats(pitchers, scale, rng)
+            scaled_gbp = scaled_games_by_pos(gbp, scale)
+            for league in SCALE_LEAGUES:
+                for engine in engines:
+                    for solver in solvers:
+                        case = bench_case(league, year, engine, solver, scaled_hitters, scaled_pitchers, repeat, scale, scaled_gbp)
+                        results["cases"].append(case)
+                        print_case(case)
+
+        priceguide.invalidate_games_by_pos(year)
+
+    return results
+
+def current_commit():
+
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return output.stdout.strip()
+
+def load_season(year):
+
+    hitters = priceguide.load_stats("", year, None, True)
+    pitchers = priceguide.load_stats("", year, None, False)
+
+    # The bundled stats have no names. Without the ID map to look them up
+    # in, the id stands in for the name.
+    if not priceguide.ID_MAP_CSV.is_file():
+        hitters["name"] = hitters["mlbam_id"].astype(str)
+        pitchers["name"] = pitchers["mlbam_id"].astype(str)
+
+    return hitters, pitchers
+
+def bench_load(year, repeat):
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        priceguide.load_stats("", year, None, True)
+        priceguide.load_stats("", year, None, False)
+        times.append(time.perf_counter() - start)
+
+    return {"year": year, "seconds": summarize(times)}
+
+def bench_case(league, year, engine, solver, hitters, pitchers, repeat, scale=1, gbp=None):
+
+    lg = priceguide.League(league)
+    lg.slot_solver = solver
+
+    totals = []
+    stage_times = {}
+    for _ in range(repeat):
+        reset_games_by_pos(year, gbp)
+        times = {}
+        with timed_stages(times):
+            start = time.perf_counter()
+            priceguide.calculate(lg, year, hitters.copy(), pitchers.copy(), engine)
+            totals.append(time.perf_counter() - start)
+        for stage, seconds in times.items():
+            stage_times.setdefault(stage, []).append(seconds)
+
+    # Memory is traced in a run of its own, since tracing slows
+    # everything down
+    reset_games_by_pos(year, gbp)
+    tracemalloc.start()
+    try:
+        priceguide.calculate(lg, year, hitters.copy(), pitchers.copy(), engine)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    case = {}
+    case["league"] = league
+    case["year"] = year
+    case["engine"] = engine
+    case["solver"] = solver
+    case["scale"] = scale
+    case["hitters"] = len(hitters)
+    case["pitchers"] = len(pitchers)
+    case["seconds"] = summarize(totals)
+    case["stages"] = {stage: summarize(times) for stage, times in stage_times.items()}
+    case["peak_mb"] = round(peak / 2**20, 2)
+
+    return case
+
+def reset_games_by_pos(year, gbp=None):
+
+    # Every run starts without the games by position cached, or with just
+    # the synthetic table for a scaled run
+    priceguide.invalidate_games_by_pos(year)
+    if gbp is not None:
+        priceguide.store_games_by_pos(year, gbp)
+
+@contextmanager
+def timed_stages(times):
+
+    # Stand-ins for each stage in priceguide that add up how long it
+    # takes, put back when we're done
+    originals = {stage: getattr(priceguide, stage) for stage in STAGES}
+
+    def timed(stage, func):
+        def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[stage] = times.get(stage, 0) + time.perf_counter() - start
+        return run
+
+    for stage, func in originals.items():
+        setattr(priceguide, stage, timed(stage, func))
+    try:
+        yield times
+    finally:
+        for stage, func in originals.items():
+            setattr(priceguide, stage, func)
+
+def summarize(times):
+    return {"min": min(times), "median": statistics.median(times)}
+
+def scaled_stats(df, scale, rng):
+
+    # Each copy is the whole season again, with every player's stats
+    # nudged up or down together so their rates stay believable
+    counting = [col for col in df.columns if col in priceguide.STAT_SCHEMA and col != "mlbam_id"]
+    dtypes = df[counting].dtypes.to_dict()
+
+    copies = [df]
+    for copy_num in range(1, scale):
+        copy = df.copy()
+        copy["mlbam_id"] = copy["mlbam_id"].astype(np.int64) + copy_num * ID_STRIDE
+        factor = rng.uniform(1 - SCALE_SPREAD, 1 + SCALE_SPREAD, (len(df), 1))
+        copy[counting] = pd.DataFrame(np.rint(df[counting].to_numpy() * factor), columns=counting).astype(dtypes)
+        if "name" in copy:
+            copy["name"] = copy["mlbam_id"].astype(str)
+        copies.append(copy)
+
+    return pd.concat(copies, ignore_index=True)
+
+def scaled_games_by_pos(gbp, scale):
+
+    copies = [gbp.set_axis(gbp.index.astype(np.int64) + copy_num * ID_STRIDE) for copy_num in range(scale)]
+
+    return pd.concat(copies).sort_index()
+
+def print_case(case):
+    print("{} {} {} {} x{}: {:.3f}s {}MB".format(case["year"], case["league"], case["engine"], case["solver"], case["scale"], case["seconds"]["median"], case["peak_mb"]))
+
+def print_solvers(results):
+
+    # How much longer each case takes with the optimal slot solver
+    def key(case):
+        return (case["league"], case["year"], case["engine"], case["scale"])
+
+    greedy = {key(case): case for case in results["cases"] if case["solver"] == priceguide.SLOT_GREEDY}
+    ratios = []
+    for case in results["cases"]:
+        if case["solver"] != priceguide.SLOT_OPTIMAL or key(case) not in greedy:
+            continue
+        ratios.append(case["seconds"]["median"] / greedy[key(case)]["seconds"]["median"])
+
+    if ratios:
+        print("optimal vs greedy slots: {} cases, geometric mean {:.2f}x, worst {:.2f}x".format(len(ratios), float(np.exp(np.mean(np.log(ratios)))), max(ratios)))
+
+def print_comparison(old, new, threshold=1.1):
+
+    # Medians side by side for every case both runs have, flagging
+    # anything that slowed down by more than the threshold. Results from
+    # before there was a choice of solver were all greedy.
+    def key(case):
+        return (case["league"], case["year"], case["engine"], case.get("solver", priceguide.SLOT_GREEDY), case["scale"])
+
+    old_cases = {key(case): case for case in old["cases"]}
+    ratios = []
+    for case in new["cases"]:
+        if key(case) not in old_cases:
+            continue
+        before = old_cases[key(case)]["seconds"]["median"]
+        after = case["seconds"]["median"]
+        ratio = after / before
+        ratios.append(ratio)
+        flag = "  SLOWER" if ratio > threshold else ""
+        print("{} {} {} {} x{}: {:.3f}s -> {:.3f}s ({:.2f}x){}".format(case["year"], case["league"], case["engine"], case["solver"], case["scale"], before, after, ratio, flag))
+
+    if ratios:
+        print("{} -> {}: {} cases, geometric mean {:.2f}x".format(old["commit"], new["commit"], len(ratios), float(np.exp(np.mean(np.log(ratios))))))
+
+
+if __name__ == "__main__":
+    main()
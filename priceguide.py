@@ -1,6 +1,217 @@
+import copy
+import csv
+import hashlib
+import heapq
+import json
+import os
+import pickle
+import re
+import time
+import zlib
+import tracemalloc
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
 from pathlib import Path
+from types import MappingProxyType
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ENGINE_PANDAS = "pandas"
+ENGINE_NUMPY = "numpy"
+
+# Numerator and denominator columns for each rate stat. Innings are
+# counted in outs, so the pitching rates are per out.
+RATE_STATS = {
+    "AVG": (["H"], ["AB"]),
+    "OBP": (["H", "BB", "HBP"], ["AB", "BB", "HBP", "SF"]),
+    "SLG": (["TB"], ["AB"]),
+    "ERA": (["ER"], ["OUTS"]),
+    "WHIP": (["H", "BB"], ["OUTS"]),
+    "K/9": (["SO"], ["OUTS"]),
+    "BB/9": (["BB"], ["OUTS"]),
+    "K/BB": (["SO"], ["BB"]),
+    "HR/9": (["HR"], ["OUTS"]),
+}
+
+# What a config's avg_rates are per. Configs saved before innings were
+# counted in outs don't say, and their pitching rates are per inning.
+RATE_UNITS = "outs"
+
+# Significant digits of the sds that tell one pass of the roto loop from
+# another. Players tied at the top are summed in whatever order they
+# sorted in, which moves the sds by a rounding error from run to run.
+SDS_DIGITS = 12
+
+# How many rows calculate_stream reads at a time, and how deep it digs
+# into each leaderboard for its first pool of candidates
+STREAM_CHUNK = 100000
+STREAM_POOL_FACTOR = 4
+
+# How many sorted runs calculate_stream merges at once, to stay well
+# under the open file limit
+STREAM_MERGE_WIDTH = 64
+
+# League settings a draft session can change without valuing again
+DRAFT_SETTINGS = ["category_scales", "catcher_scale", "budget", "hitting_split"]
+
+# How many rows quick_score works on at a time
+QUICK_CALC_CHUNK = 100000
+
+# Monte Carlo settings: scenarios valued at a time, histogram bins used
+# for the quantiles, and a cap on passes for scenarios that never settle
+SIM_CHUNK = 250
+SIM_BINS = 1000
+SIM_MAX_PASSES = 20
+SIM_QUANTILES = (0.1, 0.5, 0.9)
+
+# Where compiled lookups like the player ID map are kept between runs
+CACHE_DIR = Path(__file__).parent / "cache"
+ID_MAP_CSV = Path(__file__).parent.parent / "SFBB Player ID Map - PLAYERIDMAP.csv"
+
+# How much memory calculate_cached can hold on to, and where it keeps
+# results on disk when asked to
+RESULT_CACHE_BYTES = 256 * 2**20
+RESULT_CACHE_DIR = CACHE_DIR / "results"
+
+# What backtest writes its results as, when it's given somewhere to write
+BACKTEST_FORMAT = "parquet" if pa is not None else "csv"
+
+# How many years of games by position, and how many sets of eligibility
+# built from them, to keep loaded
+GBP_CACHE_YEARS = 4
+GBP_CACHE_ELIGIBILITY = 64
+
+# The stat columns we read, and the compact type each is kept in. IP
+# comes in baseball notation (6.2 is 6 2/3 innings), so it's kept as a
+# whole number of outs instead.
+STAT_SCHEMA = {
+    "mlbam_id": np.int32,
+    "G": np.int16,
+    "PA": np.int16,
+    "AB": np.int16,
+    "R": np.int16,
+    "H": np.int16,
+    "2B": np.int16,
+    "3B": np.int16,
+    "HR": np.int16,
+    "RBI": np.int16,
+    "SB": np.int16,
+    "CS": np.int16,
+    "BB": np.int16,
+    "SO": np.int16,
+    "HBP": np.int16,
+    "SH": np.int16,
+    "SF": np.int16,
+    "GS": np.int16,
+    "W": np.int16,
+    "L": np.int16,
+    "CG": np.int16,
+    "SHO": np.int16,
+    "SV": np.int16,
+    "BS": np.int16,
+    "HLD": np.int16,
+    "QS": np.int16,
+    "OUTS": np.int16,
+    "ER": np.int16,
+    "IBB": np.int16,
+    "BK": np.int16,
+    "WP": np.int16,
+    "BFP": np.int16,
+}
+
+# Stats add_missing_cols works out from other columns, as expressions of
+# them. They're never taken from the input, so they always agree with the
+# stats they come from. derive_stat adds more.
+DERIVED_STATS = {
+    "PA": "AB + BB + HBP + SF",
+    "TB": "H + 2B + 3B * 2 + HR * 3",
+    "1B": "H - 2B - 3B - HR",
+    "xBH": "2B + 3B + HR",
+    "RBI+R": "RBI + R",
+    "SB-CS": "SB - CS",
+    "W-L": "W - L",
+    "W+QS": "W + QS",
+    "W+QS-L": "W + QS - L",
+    "SV+HLD": "SV + HLD",
+    "SV+HLD/2": "SV + HLD / 2",
+    "AB": "OUTS - BB - HBP - SF",
+    "IP": "OUTS / 3",
+}
+
+# Derived stats only one side works out (True for hitters). A pitcher's AB
+# come from his outs, for AVG against.
+DERIVED_SIDES = {"PA": True, "AB": False, "IP": False}
+
+# Stats every frame gets, and stats some sources leave out that count as
+# zero when something needs them
+ALWAYS_STATS = {True: ["HBP", "SF", "PA"], False: ["HBP", "SF"]}
+ZERO_STATS = ["HBP", "SF", "HLD", "QS"]
+
+# The pieces of a derived stat expression: numbers, stat names and operators
+STAT_TOKEN = re.compile(r"\s*(?:(\d+(?:\.\d+)?)(?![\w.])|(\w+)|([-+*/()]))")
+
+# Columns that identify a player rather than hold his stats
+ID_COLUMNS = ["mlbam_id", "name", "name_first", "name_last", "pos"]
+
+# Rate stats that are the sum of other rate stats
+COMBINED_RATE_STATS = {"OPS": ["OBP", "SLG"]}
+
+# Other names leagues use for the categories we know
+HITTING_ALIASES = {"K": "SO", "DB": "2B", "TP": "3B"}
+PITCHING_ALIASES = {"K": "SO", "S": "SV", "BAA": "AVG"}
+
+# How many compiled league specs, category layouts and derived stat plans
+# to keep around
+LEAGUE_SPEC_CACHE = 64
+
+# How many finished roto loops to remember for recalculate to replay
+REPLAY_CACHE = 64
+
+# Each position a player can be eligible at gets its own bit.
+# Every hitter is eligible at Util and every pitcher at P.
+POSITION_BITS = {
+    "C": 1 << 0,
+    "1B": 1 << 1,
+    "2B": 1 << 2,
+    "3B": 1 << 3,
+    "SS": 1 << 4,
+    "LF": 1 << 5,
+    "CF": 1 << 6,
+    "RF": 1 << 7,
+    "OF": 1 << 8,
+    "DH": 1 << 9,
+    "Util": 1 << 10,
+    "SP": 1 << 11,
+    "RP": 1 << 12,
+    "P": 1 << 13,
+}
+
+# Roster spots that can be filled from more than one position
+POSITION_MASKS = {
+    "MI": POSITION_BITS["2B"] | POSITION_BITS["SS"],
+    "CI": POSITION_BITS["1B"] | POSITION_BITS["3B"],
+}
+
+# Roster spots any of several positions can fill. The optimal slot solver
+# tries these after the single-position spots, in this order.
+FLEX_POSITIONS = ["MI", "CI", "Util", "P"]
+
+# How replacement levels are found: filling each position in turn with the
+# best players left, or picking the roster with the highest total that
+# fits the slots no matter what order the positions are listed in
+SLOT_GREEDY = "greedy"
+SLOT_OPTIMAL = "optimal"
+
+# Positions in a player's pos string that also make him eligible elsewhere
+POSITION_ALIASES = {"LF": "OF", "CF": "OF", "RF": "OF", "DH": "Util"}
 
 class League:
     SCORING_ROTO = "R"
@@ -52,6 +263,14 @@ class League:
         self.sp_eligibility = 5
         self.rp_eligibility = 5
 
+        # The roto loop stops when its sds repeat. With a tolerance it also
+        # stops once sds change by less than that fraction and replacement
+        # levels by less than that much from one pass to the next.
+        self.convergence_tolerance = 0.0
+        self.max_iterations = 100
+
+        self.slot_solver = SLOT_GREEDY
+
         # 4x4
         if league_type == self.LEAGUE_STANDARD_4x4:
             self.hitting_categories = ["HR", "SB", "RBI", "AVG"]
@@ -191,266 +410,2383 @@ class League:
         return sum(self.pitching_positions.values()) * self.teams
 
 
-def calculate(lg, year, hitters, pitchers):
+class LeagueSpec:
+
+    # A League boiled down once into what valuing it needs: categories
+    # with their aliases resolved, slot counts, category weights and the
+    # layout of every category's stats. It can't be changed, and two specs
+    # with the same settings are equal and hash the same, so it also works
+    # as a cache key.
+    __slots__ = ("key", "settings", "teams", "budget", "hitting_split", "catcher_scale", "scoring_type", "slot_solver", "hitting", "pitching", "_hash")
+
+    def __init__(self, settings):
+        key = hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+        fields = {
+            "key": key,
+            "settings": settings,
+            "teams": settings["teams"],
+            "budget": settings["budget"],
+            "hitting_split": settings["hitting_split"],
+            "catcher_scale": settings["catcher_scale"],
+            "scoring_type": settings["scoring_type"],
+            "slot_solver": settings["slot_solver"],
+            "hitting": SideSpec(settings, True),
+            "pitching": SideSpec(settings, False),
+            "_hash": int(key[:16], 16),
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LeagueSpec can't be changed")
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, LeagueSpec) and other.key == self.key
+
+    def __repr__(self):
+        return "LeagueSpec(" + self.key[:12] + ")"
+
+    def side(self, is_batting):
+        return self.hitting if is_batting else self.pitching
+
+
+class SideSpec:
+
+    __slots__ = ("is_batting", "cats", "points", "positions", "slots", "masks", "num_players", "negative", "weights", "layout")
+
+    def __init__(self, settings, is_batting):
+        prefix = "hitting_" if is_batting else "pitching_"
+        positions = settings[prefix + "positions"]
+        cats = tuple(settings[prefix + "categories"]) if settings["scoring_type"] == League.SCORING_ROTO else ()
+        negative = np.array([cat in negative_cats(is_batting) for cat in cats], dtype=bool)
+
+        fields = {
+            "is_batting": is_batting,
+            "cats": cats,
+            "points": tuple(settings[prefix + "points"]),
+            "positions": tuple(position for position, _ in positions),
+            "slots": MappingProxyType({position: count * settings["teams"] for position, count in positions}),
+            "masks": np.array([position_mask(position) for position, _ in positions], dtype=np.int64),
+            "num_players": sum(count for _, count in positions) * settings["teams"],
+            "negative": negative,
+            "weights": category_weights(cats, dict(settings["category_scales"]), is_batting),
+            "layout": category_layout(cats),
+        }
+        for name, value in fields.items():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SideSpec can't be changed")
+
+
+_league_specs = OrderedDict()
+
+
+def league_spec(lg):
+
+    # Everything that changes the values, in a fixed order. Positions keep
+    # the order they're listed in, since the greedy fill goes by it, and
+    # points keep theirs, since totals are added up in it.
+    settings = {
+        "teams": lg.teams,
+        "budget": lg.budget,
+        "hitting_split": lg.hitting_split,
+        "catcher_scale": lg.catcher_scale,
+        "scoring_type": lg.scoring_type,
+        "hitting_categories": [HITTING_ALIASES.get(cat, cat) for cat in lg.hitting_categories],
+        "pitching_categories": [PITCHING_ALIASES.get(cat, cat) for cat in lg.pitching_categories],
+        "hitting_points": list(getattr(lg, "hitting_points", {}).items()),
+        "pitching_points": list(getattr(lg, "pitching_points", {}).items()),
+        "category_scales": sorted(lg.category_scales.items()),
+        "hitting_positions": [[position, count] for position, count in lg.hitting_positions.items()],
+        "pitching_positions": [[position, count] for position, count in lg.pitching_positions.items()],
+        "hitting_eligibility": lg.hitting_eligibility,
+        "sp_eligibility": lg.sp_eligibility,
+        "rp_eligibility": lg.rp_eligibility,
+        "convergence_tolerance": lg.convergence_tolerance,
+        "max_iterations": lg.max_iterations,
+        "slot_solver": lg.slot_solver,
+    }
+    settings = {name: spec_setting(value, name) for name, value in settings.items()}
+    text = json.dumps(settings)
+
+    if text in _league_specs:
+        _league_specs.move_to_end(text)
+    else:
+        _league_specs[text] = LeagueSpec(settings)
+        while len(_league_specs) > LEAGUE_SPEC_CACHE:
+            _league_specs.popitem(last=False)
+
+    return _league_specs[text]
+
+
+def spec_setting(value, name):
+
+    # Settings as plain Python values, so a numpy number works like the
+    # number it is and gives the same key
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [spec_setting(item, name) for item in value]
+
+    raise TypeError("League setting " + name + " can't be " + type(value).__name__)
+
+
+def calculate(lg, year, hitters, pitchers, engine=ENGINE_PANDAS, start=None):
+
+    with stage("calculate", year=year, engine=engine) as event:
+        with stage("clean_request"):
+            lg = clean_request(lg)
+
+        # Load extra info (id, name)
+        with stage("load_extra", side="hitting", rows=len(hitters)):
+            hitters = load_extra(project_stats(hitters, True, league_stats(lg, True)))
+        with stage("load_extra", side="pitching", rows=len(pitchers)):
+            pitchers = load_extra(project_stats(pitchers, False, league_stats(lg, False)))
+
+        df, config = calculate_loaded(lg, year, hitters, pitchers, engine, warm_start=start)
+        event["rows"] = len(df)
+
+    return df, config
+
+
+def calculate_many(leagues, year, hitters, pitchers, workers=1, engine=ENGINE_PANDAS):
+
+    # Leagues can come in as a dict, or as a list of League objects or
+    # league types that then key the results themselves
+    if not isinstance(leagues, dict):
+        leagues = {lg: lg for lg in leagues}
+    leagues = {key: League(lg) if isinstance(lg, str) else lg for key, lg in leagues.items()}
+
+    # Everything that doesn't depend on the league only gets loaded once.
+    # calculate_loaded leaves its frames alone, so every league can share them.
+    hitting_stats = [stat for lg in leagues.values() for stat in league_stats(clean_request(lg), True)]
+    pitching_stats = [stat for lg in leagues.values() for stat in league_stats(clean_request(lg), False)]
+    hitters = load_extra(project_stats(hitters, True, hitting_stats))
+    pitchers = load_extra(project_stats(pitchers, False, pitching_stats))
+    gbp = games_by_pos(year).reset_index()
+
+    if workers == 1 or len(leagues) < 2:
+        totals = batch_points_totals(leagues, hitters, pitchers) if engine == ENGINE_NUMPY else {}
+        return {key: calculate_loaded(clean_request(lg), year, hitters, pitchers, engine, totals=totals.get(key)) for key, lg in leagues.items()}
+
+    # The stats go to the workers through shared memory, so each one
+    # attaches to them once instead of getting them pickled with every league
+    shared = [share_frame(df) for df in (hitters, pitchers, gbp)]
+    try:
+        specs = [spec for spec, _ in shared]
+        with ProcessPoolExecutor(workers, initializer=attach_frames, initargs=(specs, year)) as pool:
+            futures = {key: pool.submit(calculate_shared, lg, year, engine) for key, lg in leagues.items()}
+            return {key: future.result() for key, future in futures.items()}
+    finally:
+        for _, shm in shared:
+            shm.close()
+            shm.unlink()
+
+
+def batch_points_totals(leagues, hitters, pitchers):
+
+    # Points totals don't depend on eligibility, so every points league
+    # gets its totals from one pass over the stats
+    points = {key: lg for key, lg in leagues.items() if lg.scoring_type != lg.SCORING_ROTO}
+    if not points:
+        return {}
+
+    totals = []
+    for df, is_batting in [(hitters, True), (pitchers, False)]:
+        pts_list = [lg.hitting_points if is_batting else lg.pitching_points for lg in points.values()]
+        all_pts = {cat: value for pts in pts_list for cat, value in pts.items()}
+        totals.append(points_totals(add_missing_cols(df.copy(deep=False), all_pts, is_batting), pts_list))
+
+    return {key: (totals[0][:, i], totals[1][:, i]) for i, key in enumerate(points)}
+
+
+def calculate_shared(lg, year, engine):
+
+    hitters, pitchers = _shared_frames
+
+    return calculate_loaded(clean_request(lg), year, hitters, pitchers, engine)
+
+
+_shared_frames = None
+
+
+def attach_frames(specs, year):
+    global _shared_frames
+
+    hitters, pitchers, gbp = [attach_frame(spec) for spec in specs]
+    _shared_frames = (hitters, pitchers)
+    store_games_by_pos(year, gbp.set_index("mlbam_id"))
+
+
+def share_frame(df):
+
+    # Numeric columns get copied into one shared block. Anything else (names,
+    # positions) is small enough to just travel along with the spec.
+    arrays = []
+    offset = 0
+    for col in df.columns:
+        if df[col].dtype.kind in "biuf":
+            arrays.append((col, df[col].dtype.str, offset))
+            offset += df[col].dtype.itemsize * len(df)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for col, dtype, start in arrays:
+        np.ndarray(len(df), dtype=dtype, buffer=shm.buf, offset=start)[:] = df[col].to_numpy()
+
+    shared_cols = [col for col, _, _ in arrays]
+    spec = {
+        "name": shm.name,
+        "rows": len(df),
+        "columns": list(df.columns),
+        "arrays": arrays,
+        "objects": df.drop(columns=shared_cols).reset_index(drop=True),
+    }
+
+    return spec, shm
+
+
+def attach_frame(spec):
+
+    # The numeric columns are read-only views on the shared block, so
+    # nothing is copied. The block stays open for as long as the worker
+    # does, since the frame is built on it.
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    _shared_blocks.append(shm)
+
+    cols = {col: spec["objects"][col] for col in spec["objects"].columns}
+    for col, dtype, start in spec["arrays"]:
+        values = np.ndarray(spec["rows"], dtype=dtype, buffer=shm.buf, offset=start)
+        values.flags.writeable = False
+        cols[col] = pd.Series(values, name=col, copy=False)
+
+    return pd.concat([cols[col] for col in spec["columns"]], axis=1, copy=False)
+
+
+_shared_blocks = []
+
+
+def backtest(leagues, years=None, system="", workers=1, engine=ENGINE_PANDAS, output_dir=None):
+
+    # Every league valued for every season. Leagues come in as a dict of
+    # names to Leagues, or a list of league types that name themselves.
+    if not isinstance(leagues, dict):
+        leagues = {lg: League(lg) for lg in leagues}
+    leagues = {key: League(lg) if isinstance(lg, str) else lg for key, lg in leagues.items()}
+    if years is None:
+        years = data_years(system)
+
+    # Each season is loaded once, with the derived columns every league
+    # needs filled in up front
+    hitting_stats = [stat for lg in leagues.values() for stat in league_stats(clean_request(lg), True)]
+    pitching_stats = [stat for lg in leagues.values() for stat in league_stats(clean_request(lg), False)]
+    seasons = {}
+    loads = []
+    for year in years:
+        start = time.perf_counter()
+        hitters = load_extra(project_stats(load_stats(system, year, None, True), True, hitting_stats))
+        pitchers = load_extra(project_stats(load_stats(system, year, None, False), False, pitching_stats))
+        hitters = add_missing_cols(hitters, hitting_stats, True)
+        pitchers = add_missing_cols(pitchers, pitching_stats, False)
+        seasons[year] = (hitters, pitchers, games_by_pos(year))
+        loads.append({"year": year, "league": None, "seconds": time.perf_counter() - start, "rows": len(hitters) + len(pitchers)})
+
+    jobs = [(year, key) for year in years for key in leagues]
+    if workers == 1 or len(jobs) < 2:
+        results = {}
+        for year, key in jobs:
+            hitters, pitchers, gbp = seasons[year]
+            store_games_by_pos(year, gbp)
+            results[year, key] = backtest_job(leagues[key], year, hitters, pitchers, engine)
+    else:
+        # Every season goes to the workers through shared memory once
+        shared = {year: [share_frame(df) for df in (hitters, pitchers, gbp.reset_index())] for year, (hitters, pitchers, gbp) in seasons.items()}
+        try:
+            specs = {year: [spec for spec, _ in frames] for year, frames in shared.items()}
+            with ProcessPoolExecutor(workers, initializer=attach_seasons, initargs=(specs,)) as pool:
+                futures = {(year, key): pool.submit(backtest_shared, leagues[key], year, engine) for year, key in jobs}
+                results = {job: future.result() for job, future in futures.items()}
+        finally:
+            for frames in shared.values():
+                for _, shm in frames:
+                    shm.close()
+                    shm.unlink()
+
+    # One table of values, and one of how long each load and job took
+    values = []
+    timings = list(loads)
+    for (year, key), (df, _, seconds) in results.items():
+        values.append(df.assign(year=year, league=str(key)))
+        timings.append({"year": year, "league": str(key), "seconds": seconds, "rows": len(df)})
+    values = pd.concat(values, ignore_index=True)
+    values = values[["year", "league"] + [col for col in values.columns if col not in ["year", "league"]]]
+    timings = pd.DataFrame(timings, columns=["year", "league", "seconds", "rows"])
+    configs = {job: config for job, (_, config, _) in results.items()}
+
+    if output_dir is not None:
+        write_backtest(Path(output_dir), values, timings)
+
+    return values, timings, configs
+
+
+def backtest_job(lg, year, hitters, pitchers, engine):
+
+    start = time.perf_counter()
+    df, config = calculate_loaded(clean_request(lg), year, hitters, pitchers, engine)
+
+    return df, config, time.perf_counter() - start
+
+
+def backtest_shared(lg, year, engine):
+
+    hitters, pitchers, gbp = _shared_seasons[year]
+    store_games_by_pos(year, gbp)
+
+    return backtest_job(lg, year, hitters, pitchers, engine)
+
+
+_shared_seasons = {}
+
+
+def attach_seasons(specs):
 
+    for year, year_specs in specs.items():
+        hitters, pitchers, gbp = [attach_frame(spec) for spec in year_specs]
+        _shared_seasons[year] = (hitters, pitchers, gbp.set_index("mlbam_id"))
+
+
+def write_backtest(output_dir, values, timings):
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in [("values", values), ("timings", timings)]:
+        path = output_dir / (name + "." + BACKTEST_FORMAT)
+        tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+        if BACKTEST_FORMAT == "parquet":
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def recalculate(lg, year, hitters, pitchers, config, changed_hitters=None, changed_pitchers=None):
+
+    # Values again after some players' stats changed. The results are the
+    # same as calculate() with ENGINE_NUMPY on the changed stats. If none of
+    # the changed players, before or after the change, could have made the
+    # top group or a roster on any pass of the earlier loop, the loop goes
+    # exactly the same way again, so only its last pass is run. Otherwise
+    # everyone is valued from scratch.
     lg = clean_request(lg)
 
-    # Load extra info (id, name)
-    hitters = load_extra(hitters)
-    pitchers = load_extra(pitchers)
-    
+    # The loops calculate ran in this process are remembered by league and
+    # where they ended, so a config that's been saved and loaded again
+    # still finds its loop
+    replay = {}
+    for side, changes, is_batting in [("hitting", changed_hitters, True), ("pitching", changed_pitchers, False)]:
+        loop = _replays.get(replay_key(lg, is_batting, config.get(side, {}).get("sds")))
+        if loop is not None:
+            changed = changes["mlbam_id"].to_numpy() if changes is not None else np.arange(0)
+            replay[side] = dict(loop, changed=changed)
+
+    hitters = load_extra(project_stats(apply_changes(hitters, changed_hitters), True, league_stats(lg, True)))
+    pitchers = load_extra(project_stats(apply_changes(pitchers, changed_pitchers), False, league_stats(lg, False)))
+
+    return calculate_loaded(lg, year, hitters, pitchers, ENGINE_NUMPY, replay=replay)
+
+
+def apply_changes(df, changes):
+
+    if changes is None:
+        return df
+
+    # Changed players replace their old rows where they were, so the first
+    # pass of the loop still sees the same players first, and anyone new
+    # goes on the end
+    replaced = df["mlbam_id"].isin(changes["mlbam_id"]).to_numpy()
+    positions = pd.Series(np.arange(len(df)), index=df["mlbam_id"].to_numpy())
+    positions = positions[~positions.index.duplicated()]
+
+    moved = positions.reindex(changes["mlbam_id"].to_numpy()).to_numpy()
+    new = np.isnan(moved)
+    moved[new] = len(df) + np.arange(new.sum())
+
+    merged = pd.concat([df[~replaced], changes], ignore_index=True)
+    keys = np.concatenate([np.flatnonzero(~replaced), moved])
+
+    return merged.iloc[np.argsort(keys, kind="stable")].reset_index(drop=True)
+
+
+def calculate_cached(lg, year, hitters, pitchers, engine=ENGINE_PANDAS, data_key=None, disk=False):
+
+    # The same request again gets the same results back. Requests match on
+    # the cleaned league settings, the year, the engine, the games by
+    # position files and the stats, either fingerprinted or named by
+    # data_key. The config is shared between hits, so leave it as it is.
+    lg = clean_request(lg)
+    if data_key is None:
+        data_key = [frame_fingerprint(hitters), frame_fingerprint(pitchers)]
+    key = result_key(lg, year, engine, data_key)
+
+    if key in _results:
+        _results.move_to_end(key)
+        _result_stats["hits"] += 1
+        df, config, _ = _results[key]
+        return df.copy(), config
+
+    result = read_result(key) if disk else None
+    if result is not None:
+        _result_stats["disk_hits"] += 1
+    else:
+        _result_stats["misses"] += 1
+        result = calculate(lg, year, hitters, pitchers, engine)
+        if disk:
+            write_result(key, result)
+
+    store_result(key, result)
+
+    return result[0].copy(), result[1]
+
+
+def result_key(lg, year, engine, data_key):
+
+    settings = league_spec(lg).key
+
+    # Rewriting a games by position file changes the results too, and so
+    # does a new ID map for stats without names
+    paths = {gbp_year: Path(__file__).parent / "games_by_pos" / (str(gbp_year) + ".csv") for gbp_year in (year - 1, year)}
+    paths["names"] = ID_MAP_CSV
+
+    files = []
+    for name, path in paths.items():
+        if path.is_file():
+            stat = path.stat()
+            files.append([name, stat.st_mtime_ns, stat.st_size])
+
+    request = json.dumps([code_hash(), pd.__version__, settings, year, engine, files, data_key], default=str)
+
+    return hashlib.sha1(request.encode()).hexdigest()
+
+
+def frame_fingerprint(df):
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(col) for col in df.columns], [str(dtype) for dtype in df.dtypes]]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+_code_hash = None
+
+
+def code_hash():
+    global _code_hash
+
+    # Results saved by a different version of this file don't count
+    if _code_hash is None:
+        _code_hash = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()
+
+    return _code_hash
+
+
+_results = OrderedDict()
+_results_bytes = 0
+_result_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+
+def store_result(key, result):
+    global _results_bytes
+
+    df, config = result
+    size = int(df.memory_usage(deep=True).sum()) + len(pickle.dumps(config))
+    if size > RESULT_CACHE_BYTES:
+        return
+
+    _results[key] = (df, config, size)
+    _results_bytes += size
+    while _results_bytes > RESULT_CACHE_BYTES:
+        _, (_, _, old_size) = _results.popitem(last=False)
+        _results_bytes -= old_size
+        _result_stats["evictions"] += 1
+
+
+def result_cache_info():
+
+    info = dict(_result_stats)
+    info["entries"] = len(_results)
+    info["bytes"] = _results_bytes
+
+    return info
+
+
+def clear_result_cache(disk=False):
+    global _results_bytes
+
+    _results.clear()
+    _results_bytes = 0
+    for stat in _result_stats:
+        _result_stats[stat] = 0
+
+    if disk and RESULT_CACHE_DIR.is_dir():
+        for path in RESULT_CACHE_DIR.glob("*.pkl.z"):
+            path.unlink()
+
+
+def result_path(key):
+    return RESULT_CACHE_DIR / (key + ".pkl.z")
+
+
+def read_result(key):
+
+    # Results are pickled, so only ones this user wrote get loaded
+    path = result_path(key)
+    if not path.is_file() or not trusted_file(path):
+        return None
+
+    return pickle.loads(zlib.decompress(path.read_bytes()))
+
+
+def trusted_file(path):
+
+    stat = path.stat()
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        return False
+
+    return not stat.st_mode & 0o022
+
+
+def write_result(key, result):
+
+    # Written under a temporary name first so another process never
+    # picks up half a file
+    RESULT_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    path = result_path(key)
+    tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+    tmp_path.write_bytes(zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp_path, path)
+
+
+def calculate_stream(lg, year, hitters_path, pitchers_path, output_path, chunk_size=STREAM_CHUNK):
+
+    # Values stat files too big to load, reading them a chunk at a time.
+    # The league-wide stats come from a pool of candidates pulled from the
+    # files, and then every row is scored against them. Each chunk is
+    # written out sorted as a run of its own, and the runs are merged into
+    # one file sorted by $, like calculate's.
+    lg = clean_request(lg)
+    inputs = [("hitting", hitters_path, True), ("pitching", pitchers_path, False)]
+
+    # Every chunk of the pitching file reads IP the same way
+    decimal = {"hitting": False, "pitching": ip_is_decimal(pitchers_path, chunk_size)}
+
+    sides = {side: stream_config(path, lg, year, is_batting, chunk_size, decimal[side]) for side, path, is_batting in inputs}
+
+    # Each chunk is merged with an empty frame from the other side, so its
+    # columns match what calculate would give
+    templates = {side: stream_finish(sides[side][0].iloc[:0], lg, is_batting, 1) for side, _, is_batting in inputs}
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + "." + str(os.getpid()) + ".tmp")
+    runs = []
+    try:
+        for side, path, is_batting in inputs:
+            values, config = sides[side]
+            for part in stream_values(path, lg, year, is_batting, chunk_size, decimal[side], values, config):
+                if is_batting:
+                    df = pd.merge(part, templates["pitching"], how="outer", suffixes=("_H", "_P"), on=["mlbam_id", "name", "pos", "$", "total", "adj_total",])
+                else:
+                    df = pd.merge(templates["hitting"], part, how="outer", suffixes=("_H", "_P"), on=["mlbam_id", "name", "pos", "$", "total", "adj_total",])
+                runs.append(tmp_path.with_name(tmp_path.name + "." + str(len(runs))))
+                format_final_columns(df, lg).to_csv(runs[-1], index=False)
+        merge_runs(runs, tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        for run in runs:
+            run.unlink(missing_ok=True)
+
+    return {side: config for side, (_, config) in sides.items()}
+
+
+def merge_runs(runs, path):
+
+    # Every run is sorted by $ already, so merging them only needs a row
+    # from each at a time. Too many runs to open at once are merged in
+    # groups first.
+    runs = list(runs)
+    merged = []
+    try:
+        while len(runs) > STREAM_MERGE_WIDTH:
+            merged.append(path.with_name(path.name + ".m" + str(len(merged))))
+            merge_sorted(runs[:STREAM_MERGE_WIDTH], merged[-1])
+            for run in runs[:STREAM_MERGE_WIDTH]:
+                run.unlink()
+            runs = runs[STREAM_MERGE_WIDTH:] + [merged[-1]]
+
+        merge_sorted(runs, path)
+    finally:
+        for run in merged:
+            run.unlink(missing_ok=True)
+
+
+def merge_sorted(runs, path):
+
+    files = [open(run, newline="") for run in runs]
+    try:
+        readers = [csv.reader(f) for f in files]
+        header = [next(reader) for reader in readers][0]
+        dollars = header.index("$")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*readers, key=lambda row: -float(row[dollars])))
+    finally:
+        for f in files:
+            f.close()
+
+
+def stream_config(path, lg, year, is_batting, chunk_size, decimal):
+
+    num_players = lg.num_hitters if is_batting else lg.num_pitchers
+    roto = lg.scoring_type == lg.SCORING_ROTO
+
+    # Value the pool, then check nobody outside it could have beaten a
+    # cutoff on any pass. If someone could
+    # have, try again with a deeper pool. Players tied at a cutoff, inside
+    # the pool or out, and loops that end by cycling can still come out
+    # differently than calculate would, so those results aren't exact.
+    factor = STREAM_POOL_FACTOR
+    while True:
+        pool = stream_pool(path, lg, year, is_batting, chunk_size, decimal, factor)
+        if not roto:
+            values, config = build_points_values(pool, lg, is_batting)
+            exact = True
+            break
+
+        history = []
+        values, config = build_values_np(pool, lg, is_batting, history)
+        covered, exact = stream_is_exact(path, lg, year, is_batting, chunk_size, decimal, pool["row"].to_numpy(), history)
+        if covered:
+            settled = len(history) > 1 and np.array_equal(history[-1]["sds"], history[-2]["sds"])
+            exact = exact and settled and all(state["exact"] for state in history)
+            break
+        factor *= 2
+
+    # Pool values are kept by their row in the file
+    values.index = pool["row"].to_numpy()[values.index]
+    values = values.drop(columns="row", errors="ignore")
+
+    config["dollar_rate"] = calc_dollar_values(values.head(num_players).copy(), lg, is_batting)[1]
+    config["stream"] = {"pool": len(pool), "exact": exact}
+
+    return values, config
+
+
+def read_chunks(path, chunk_size, columns=None):
+
+    path = Path(path)
+    if path.suffix == ".parquet":
+        if pa is None:
+            raise ImportError("Reading Parquet files needs pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, usecols=columns)
+
+
+def file_columns(path):
+
+    path = Path(path)
+    if path.suffix == ".parquet":
+        if pa is None:
+            raise ImportError("Reading Parquet files needs pyarrow")
+        return pq.ParquetFile(path).schema_arrow.names
+
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def ip_is_decimal(path, chunk_size):
+
+    # IP only counts as baseball notation if the whole file is in thirds,
+    # the same as when it's loaded in one go. Only the IP column is read.
+    columns = file_columns(path)
+    if "OUTS" in columns or "IP" not in columns:
+        return False
+
+    for chunk in read_chunks(path, chunk_size, ["IP"]):
+        ip = pd.to_numeric(chunk["IP"]).to_numpy(dtype=np.float64)
+        if ip_to_outs(ip[~np.isnan(ip)]) is None:
+            return True
+
+    return False
+
+
+def stream_chunks(path, lg, year, is_batting, chunk_size, decimal):
+
+    # Every row is numbered by its place in the file, so later passes can
+    # tell which rows made the pool
+    stats = league_stats(lg, is_batting)
+    offset = 0
+    for chunk in read_chunks(path, chunk_size):
+        df = load_extra(project_stats(chunk, is_batting, stats, decimal))
+        df = add_missing_cols(load_games_by_pos(df, lg, year, is_batting), stats, is_batting)
+        df["row"] = np.arange(offset, offset + len(df))
+        offset += len(df)
+        yield df
+
+
+def stream_pool(path, lg, year, is_batting, chunk_size, decimal, factor):
+
+    # Roto candidates are ranked on the first pass of the loop, whose top
+    # group is the first rows in the file, so chunks wait until those have
+    # all been read
+    num_players = lg.num_hitters if is_batting else lg.num_pitchers
+    roto = lg.scoring_type == lg.SCORING_ROTO
+
+    pool = None
+    lead = None
+    waiting = []
+    for chunk in stream_chunks(path, lg, year, is_batting, chunk_size, decimal):
+        waiting.append(chunk)
+        if roto and lead is None:
+            if not len(chunk) or chunk["row"].iloc[-1] < num_players - 1:
+                continue
+            lead = stream_lead(waiting, num_players)
+        pool = stream_rank(pool, waiting, lg, is_batting, factor, lead)
+        waiting = []
+
+    # A file shorter than the top group is all lead
+    if waiting:
+        lead = stream_lead(waiting, num_players) if roto else None
+        pool = stream_rank(pool, waiting, lg, is_batting, factor, lead)
+
+    if pool is None:
+        raise ValueError("No players in " + str(path))
+
+    # Back in file order, which the first pass of the roto loop goes by
+    return pool.sort_values("row").reset_index(drop=True)
+
+
+def stream_lead(chunks, num_players):
+
+    lead = pd.concat(chunks, ignore_index=True)
+
+    return lead[lead["row"].to_numpy() < num_players]
+
+
+def stream_rank(pool, chunks, lg, is_batting, factor, lead):
+
+    for chunk in chunks:
+        df = chunk if pool is None else pd.concat([pool, chunk], ignore_index=True)
+        pool = df.iloc[stream_candidates(df, lg, is_batting, factor, lead)]
+
+    return pool
+
+
+def stream_candidates(df, lg, is_batting, factor, lead=None):
+
+    if is_batting:
+        cats = lg.hitting_categories
+        positions = lg.hitting_positions
+        num_players = lg.num_hitters
+    else:
+        cats = lg.pitching_categories
+        positions = lg.pitching_positions
+        num_players = lg.num_pitchers
+
+    # Players are ranked by their totals on the first pass of the roto
+    # loop, which only depend on the first rows in the file, or by their
+    # points
+    if lead is not None:
+        avg_rates, lead_values = calc_rate_values(pack_categories(lead, cats), np.arange(len(lead)))
+        values = rate_values(pack_categories(df, cats), avg_rates)
+        weights = category_weights(cats, lg.category_scales, is_batting)
+        rough = calc_category_z(values, lead_values.mean(axis=1), lead_values.std(axis=1), weights).sum(axis=0)
+    else:
+        pts = lg.hitting_points if is_batting else lg.pitching_points
+        rough = points_totals(df, [pts])[:, 0]
+
+    # The first rows always stay in, then anyone near the top of the league
+    # or near the top at any position they can fill
+    keep = df["row"].to_numpy() < num_players
+    keep[top_indexes(rough, factor * num_players)] = True
+
+    elig = allocation_elig(df["elig"].to_numpy(), positions)
+    for position, count in positions.items():
+        eligible = np.flatnonzero((elig & position_mask(position)) != 0)
+        keep[eligible[top_indexes(rough[eligible], factor * count * lg.teams)]] = True
+
+    return np.flatnonzero(keep)
+
+
+def stream_is_exact(path, lg, year, is_batting, chunk_size, decimal, pool_rows, history):
+
+    exact = True
+    for chunk in stream_chunks(path, lg, year, is_batting, chunk_size, decimal):
+        tail = chunk[~np.isin(chunk["row"].to_numpy(), pool_rows)]
+        if not len(tail):
+            continue
+        if not pool_is_exact(tail, history, lg, is_batting, ties=False):
+            return False, False
+        exact = exact and pool_is_exact(tail, history, lg, is_batting)
+
+    return True, exact
+
+
+def stream_values(path, lg, year, is_batting, chunk_size, decimal, values, config):
+
+    num_players = lg.num_hitters if is_batting else lg.num_pitchers
+    total_points = values.head(num_players)["adj_total"].sum()
+
+    # Pool rows keep the values they got in the pool, and everyone else is
+    # scored against the pool's results
+    for chunk in stream_chunks(path, lg, year, is_batting, chunk_size, decimal):
+        rows = chunk["row"].to_numpy()
+        in_pool = np.isin(rows, values.index)
+
+        if lg.scoring_type == lg.SCORING_ROTO:
+            scored = score_values(chunk[~in_pool], config, lg, is_batting)
+        else:
+            scored = score_points(chunk[~in_pool], config, lg, is_batting)
+        scored.index = rows[~in_pool]
+
+        part = pd.concat([values.loc[rows[in_pool]], scored[values.columns]]).sort_index()
+
+        yield stream_finish(part, lg, is_batting, total_points)
+
+
+def stream_finish(df, lg, is_batting, total_points):
+
+    positions = lg.hitting_positions if is_batting else lg.pitching_positions
+    df = render_positions(df, positions, is_batting)
+    df, _ = calc_dollar_values(df, lg, is_batting, total_points)
+
+    return df
+
+
+def score_points(df, lg_stats, lg, is_batting):
+
+    # Score players against the results of an earlier points valuation
+    positions = lg.hitting_positions if is_batting else lg.pitching_positions
+    total = points_totals(df, [lg_stats["pts"]])[:, 0]
+
+    elig = allocation_elig(df["elig"].to_numpy(), positions)
+    adj_total = adjusted_totals(total, elig, lg_stats["repl"])
+    adj_total[(df["elig"].to_numpy() & POSITION_BITS["C"]) != 0] *= lg.catcher_scale
+
+    return df.assign(total=total, adj_total=adj_total)
+
+
+def calculate_loaded(lg, year, hitters, pitchers, engine=ENGINE_PANDAS, warm_start=None, totals=None, replay=None):
+
+    warm_start = warm_start or {}
+    totals = totals or (None, None)
+    replay = replay or {}
+
     # Add positions
-    hitters = load_games_by_pos(hitters, lg, year, True)
-    pitchers = load_games_by_pos(pitchers, lg, year, False)
+    with stage("load_games_by_pos", side="hitting", rows=len(hitters)):
+        hitters = load_games_by_pos(hitters, lg, year, True)
+    with stage("load_games_by_pos", side="pitching", rows=len(pitchers)):
+        pitchers = load_games_by_pos(pitchers, lg, year, False)
 
     # Build values
-    hitters, hitting_config = build_values(hitters, lg, True)
-    pitchers, pitching_config = build_values(pitchers, lg, False)
+    with stage("build_values", side="hitting", engine=engine, rows=len(hitters)):
+        hitters, hitting_config = build_side(hitters, lg, True, engine, warm_start.get("hitting"), totals[0], replay.get("hitting"))
+    with stage("build_values", side="pitching", engine=engine, rows=len(pitchers)):
+        pitchers, pitching_config = build_side(pitchers, lg, False, engine, warm_start.get("pitching"), totals[1], replay.get("pitching"))
+
+    with stage("render_positions"):
+        hitters = render_positions(hitters, lg.hitting_positions, True)
+        pitchers = render_positions(pitchers, lg.pitching_positions, False)
 
     # Convert to dollar values
-    hitters, hitting_config["dollar_rate"] = calc_dollar_values(hitters, lg, True)
-    pitchers, pitching_config["dollar_rate"] = calc_dollar_values(pitchers, lg, False)
+    with stage("calc_dollar_values"):
+        hitters, hitting_config["dollar_rate"] = calc_dollar_values(hitters, lg, True)
+        pitchers, pitching_config["dollar_rate"] = calc_dollar_values(pitchers, lg, False)
     
     config = {}
     config["hitting"] = hitting_config
     config["pitching"] = pitching_config
 
-    df = pd.merge(hitters, pitchers, how="outer", suffixes=("_H", "_P"), on=["mlbam_id", "name", "pos", "$", "total", "adj_total",])
+    with stage("merge") as event:
+        df = pd.merge(hitters, pitchers, how="outer", suffixes=("_H", "_P"), on=["mlbam_id", "name", "pos", "$", "total", "adj_total",])
+        event["rows"] = len(df)
 
-    df = format_final_columns(df, lg)
+    with stage("format_final_columns", rows=len(df)):
+        df = format_final_columns(df, lg)
 
     return df, config
 
+
+def build_side(df, lg, is_batting, engine, warm_start=None, total=None, replay=None):
+
+    if replay is not None:
+        return build_values_np(df, lg, is_batting, replay=replay)
+    elif warm_start is not None and engine == ENGINE_NUMPY:
+        return build_values_np(df, lg, is_batting, warm_start=warm_start)
+    elif warm_start is not None:
+        return build_values(df, lg, is_batting, warm_start)
+    elif total is not None:
+        return build_values_np(df, lg, is_batting, total=total)
+    elif engine == ENGINE_NUMPY:
+        return build_values_np(df, lg, is_batting)
+    else:
+        return build_values(df, lg, is_batting)
+
+
+# Opt-in instrumentation. Each listener is called with an event dict for
+# every stage of a valuation: its name, wall time, rows and anything else
+# the stage knows, plus memory use if tracemalloc is tracing. With no
+# listeners, stages aren't timed at all.
+_listeners = []
+_open_stages = []
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+@contextmanager
+def profile(listener=None, trace_memory=False):
+
+    # Collects every event while it's open, and passes them on to listener
+    events = []
+
+    def collect(event):
+        events.append(event)
+        if listener is not None:
+            listener(event)
+
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    add_listener(collect)
+    try:
+        yield events
+    finally:
+        remove_listener(collect)
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(name, **fields):
+
+    if not _listeners:
+        yield fields
+        return
+
+    event = {"stage": name}
+    event.update(fields)
+    event["depth"] = len(_open_stages)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    _open_stages.append(event)
+    try:
+        yield event
+    except BaseException as error:
+        event["error"] = type(error).__name__
+        raise
+    finally:
+        _open_stages.pop()
+        event["seconds"] = time.perf_counter() - start
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            event["memory"] = current - start_memory
+            event["peak_memory"] = peak
+        for listener in list(_listeners):
+            listener(event)
+
+
+def note_stage(**fields):
+
+    # Lets code deep inside a stage add to its event, like how many passes
+    # the convergence loop took
+    if _open_stages:
+        _open_stages[-1].update(fields)
+
+
+def json_lines(f):
+
+    # A listener that writes each event to f as a line of JSON
+    def write(event):
+        f.write(json.dumps(event, default=str) + "\n")
+        f.flush()
+
+    return write
+
+
 def quick_calc(config, df, is_batting):
 
-    if is_batting:
-        lg_stats = config["hitting"]
-    else:
-        lg_stats = config["pitching"]
+    if is_batting:
+        lg_stats = config["hitting"]
+    else:
+        lg_stats = config["pitching"]
+
+    stats = lg_stats.get("cats", lg_stats.get("pts"))
+    values = add_missing_cols(project_stats(df, is_batting, stats), stats, is_batting)
+
+    # Adjust for position
+    values["pos"] = quick_positions(values, lg_stats["repl"], is_batting)
+
+    scores = quick_score(compile_scorer(config, is_batting), values)
+    for col in scores.columns.drop("$"):
+        values[col] = scores[col].to_numpy()
+
+    if "cats" in lg_stats.keys():
+        values = calculate_rate_stats(values, lg_stats["cats"])
+        for cat in lg_stats["cats"]:
+            values = round_column(values, cat, cat)
+
+    # Convert to dollar value
+    values["$"] = scores["$"].to_numpy()
+
+    # Everything else in the caller's frame comes back with the values, but
+    # the frame itself is left alone. The rows line up one for one, so
+    # they're set by position rather than by index, which may repeat.
+    df = df.copy(deep=False)
+    for col in values.columns:
+        df[col] = values[col].to_numpy()
+
+    return df
+
+
+def compile_scorer(config, is_batting, dtype=np.float64):
+
+    if is_batting:
+        lg_stats = config["hitting"]
+    else:
+        lg_stats = config["pitching"]
+
+    # Every category score is linear in the stats, so the whole config
+    # folds down to one weight per stat and category plus an offset. The
+    # last column of the matrix gives the total, so one multiply does it all.
+    if "cats" in lg_stats.keys():
+        stats = lg_stats["cats"]
+        m_cats = ["m" + cat for cat in stats]
+
+        terms = []
+        offsets = np.zeros(len(stats) + 1)
+        avg_rates = config_rates(lg_stats)
+        for i, cat in enumerate(stats):
+            sign = -1.0 if cat in negative_cats(is_batting) else 1.0
+            sd = lg_stats["sds"][cat]
+            if cat in avg_rates:
+                for rate in COMBINED_RATE_STATS.get(cat, [cat]):
+                    num, den = RATE_STATS[rate]
+                    terms += [(col, i, sign / sd) for col in num]
+                    terms += [(col, i, -sign * avg_rates[rate] / sd) for col in den]
+            else:
+                terms.append((cat, i, sign / sd))
+                offsets[i] = -sign * lg_stats["means"][cat] / sd
+
+        cols = list(dict.fromkeys(col for col, _, _ in terms))
+        weights = np.zeros((len(cols), len(stats) + 1))
+        for col, i, weight in terms:
+            weights[cols.index(col), i] += weight
+        weights[:, -1] = weights[:, :-1].sum(axis=1)
+        offsets[-1] = offsets[:-1].sum()
+    else:
+        stats = lg_stats["pts"]
+        m_cats = []
+        cols = list(stats)
+        weights = np.array([[value] for value in stats.values()], dtype=np.float64)
+        offsets = np.zeros(1)
+
+    scorer = {}
+    scorer["is_batting"] = is_batting
+    scorer["stats"] = stats
+    scorer["cols"] = cols
+    scorer["m_cats"] = m_cats
+    scorer["dtype"] = np.dtype(dtype)
+    scorer["weights"] = weights.astype(dtype)
+    scorer["offsets"] = offsets.astype(dtype)
+    scorer["repl"] = lg_stats["repl"]
+    scorer["dollar_rate"] = lg_stats["dollar_rate"]
+
+    return scorer
+
+
+def quick_score(scorer, df, chunk_size=QUICK_CALC_CHUNK):
+
+    dtype = scorer["dtype"]
+    scores = np.empty((len(df), len(scorer["m_cats"]) + 1), dtype=dtype)
+    repl = np.empty(len(df), dtype=dtype)
+
+    # Derived stats only get filled in when the rows don't already have them
+    derive = any(col not in df for col in scorer["cols"])
+
+    # Scored a chunk at a time so the intermediate arrays stay small no
+    # matter how many rows come in
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        if derive:
+            chunk = add_missing_cols(chunk.copy(deep=False), scorer["stats"], scorer["is_batting"])
+
+        stats = chunk[scorer["cols"]].to_numpy(dtype=dtype)
+        scores[start:start + chunk_size] = stats @ scorer["weights"] + scorer["offsets"]
+        repl[start:start + chunk_size] = quick_repl(chunk, scorer["repl"], scorer["is_batting"])
+
+    total = scores[:, -1]
+    adj_total = total - repl
+
+    cols = {m_cat: scores[:, i] for i, m_cat in enumerate(scorer["m_cats"])}
+    cols["total"] = total
+    cols["repl"] = repl
+    cols["adj_total"] = adj_total
+    cols["$"] = adj_total * dtype.type(scorer["dollar_rate"]) + dtype.type(1)
+
+    return pd.DataFrame(cols, index=df.index)
+
+
+def quick_repl(df, repl, is_batting):
+
+    if not is_batting and "SP" in repl:
+        return np.where(df["GS"].to_numpy() >= df["G"].to_numpy() / 2, repl["SP"], repl.get("RP", np.nan))
+
+    lookup = dict(repl)
+    for position, alias in POSITION_ALIASES.items():
+        if alias in repl:
+            lookup.setdefault(position, repl[alias])
+
+    return df["pos"].map(lookup).to_numpy(dtype=np.float64)
+
+
+def quick_positions(df, repl, is_batting):
+
+    pos = df["pos"].replace("DH", "Util").replace(["LF","CF","RF"], "OF")
+
+    # We'll count a player as SP if he starts at least half of his games
+    if not is_batting:
+        if "SP" in repl:
+            pos = pd.Series(np.where((df.GS >= (df.G / 2)), "SP", "RP"), index=df.index)
+
+    return pos
+
+
+def draft_session(lg, year, hitters, pitchers, engine=ENGINE_PANDAS):
+
+    # Values the league once and keeps what's needed to value it again
+    # quickly as players come off the board or settings change. Each
+    # player's category z-scores stay fixed at the league's averages and
+    # sds, so only the totals, replacement levels and dollars move.
+    lg = clean_request(lg)
+
+    session = {}
+    session["league"] = lg
+    session["engine"] = engine
+    for side, df, is_batting in [("hitting", hitters, True), ("pitching", pitchers, False)]:
+        stats = league_stats(lg, is_batting)
+        df = load_extra(project_stats(df, is_batting, stats))
+        df = add_missing_cols(load_games_by_pos(df, lg, year, is_batting), stats, is_batting)
+        values, config = build_side(df, lg, is_batting, engine)
+        session[side] = draft_side(df, values, config, lg, is_batting)
+
+    draft_update(session)
+
+    return session
+
+
+def draft_side(df, values, config, lg, is_batting):
+
+    positions = lg.hitting_positions if is_batting else lg.pitching_positions
+    values = render_positions(values, positions, is_batting)
+
+    side = {}
+    side["is_batting"] = is_batting
+    side["players"] = values.reindex(df.index)[["mlbam_id", "name", "pos"]].reset_index(drop=True)
+    side["elig"] = allocation_elig(df["elig"].to_numpy(), positions)
+    side["catchers"] = (df["elig"].to_numpy() & POSITION_BITS["C"]) != 0
+    side["available"] = np.ones(len(df), dtype=bool)
+    side["stats"] = df
+
+    return draft_basis(side, config)
+
+
+def draft_basis(side, config):
+
+    # One row of z-scores per category, before signs and scales. Points
+    # leagues just keep each player's total.
+    side["config"] = config
+    if "cats" in config:
+        cats = config["cats"]
+        means = np.array([config["means"][cat] for cat in cats])
+        sds = np.array([config["sds"][cat] for cat in cats])
+        values = rate_values(pack_categories(side["stats"], cats), config["avg_rates"])
+        side["z"] = calc_category_z(values, means, sds, np.ones(len(cats)))
+    else:
+        side["total"] = points_totals(side["stats"], [config["pts"]])[:, 0]
+
+    return side
+
+
+def draft_remove(session, ids):
+
+    # Players taken off the board drop out of the pool entirely, as if
+    # they'd never been projected
+    for side in ["hitting", "pitching"]:
+        players = session[side]["players"]
+        session[side]["available"] &= ~players["mlbam_id"].isin(ids).to_numpy()
+
+    return draft_update(session)
+
+
+def draft_restore(session, ids):
+
+    for side in ["hitting", "pitching"]:
+        players = session[side]["players"]
+        session[side]["available"] |= players["mlbam_id"].isin(ids).to_numpy()
+
+    return draft_update(session)
+
+
+def draft_settings(session, **settings):
+
+    unknown = [name for name in settings if name not in DRAFT_SETTINGS]
+    if unknown:
+        raise ValueError("A draft session can't change " + ", ".join(unknown) + " without valuing the league again")
+
+    lg = copy.copy(session["league"])
+    for name, value in settings.items():
+        setattr(lg, name, value)
+    session["league"] = lg
+
+    return draft_update(session)
+
+
+def draft_refresh(session):
+
+    # Values the players still on the board from scratch, so the averages
+    # and sds the session holds on to are theirs again
+    lg = session["league"]
+    for side in ["hitting", "pitching"]:
+        df = session[side]["stats"]
+        _, config = build_side(df[session[side]["available"]].copy(), lg, session[side]["is_batting"], session["engine"])
+        draft_basis(session[side], config)
+
+    return draft_update(session)
+
+
+def draft_update(session):
+
+    lg = session["league"]
+    sides = []
+    for side in ["hitting", "pitching"]:
+        df, repl, dollar_rate, drift = draft_side_values(session[side], lg)
+        session[side]["repl"] = repl
+        session[side]["dollar_rate"] = dollar_rate
+        session[side]["drift"] = drift
+        sides.append(df)
+
+    session["values"] = pd.concat(sides, ignore_index=True).sort_values(by="$", ascending=False)
+
+    return session["values"]
+
+
+def draft_side_values(side, lg):
+
+    is_batting = side["is_batting"]
+    spec = league_spec(lg).side(is_batting)
+    slots = spec.slots
+
+    available = np.flatnonzero(side["available"])
+    if "z" in side:
+        total = spec.weights @ side["z"][:, available]
+    else:
+        total = side["total"][available]
+
+    elig = side["elig"][available]
+    _, repl = assign_slots(total, elig, slots, solver=lg.slot_solver)
+    adj_total = adjusted_totals(total, elig, repl)
+    adj_total[side["catchers"][available]] *= lg.catcher_scale
+
+    order = sort_order(adj_total)
+    df = side["players"].iloc[available[order]].assign(total=total[order], adj_total=adj_total[order])
+    df, dollar_rate = calc_dollar_values(df, lg, is_batting)
+
+    # How far the top players left have moved from the averages and sds
+    # the z-scores were frozen at, in sds. Zero means they still fit.
+    drift = 0.0
+    if "z" in side:
+        # Categories with no spread at all have nothing to drift from
+        z = side["z"][side["z"].any(axis=1)]
+        top = z[:, available[order[:spec.num_players]]]
+        if top.size:
+            drift = float(max(np.abs(top.mean(axis=1)).max(), np.abs(top.std(axis=1) - 1).max()))
+
+    df["total"] = df["total"].round(1)
+    df["adj_total"] = df["adj_total"].round(1)
+    df["$"] = df["$"].round(2)
+
+    return df, repl, dollar_rate, drift
+
+
+def simulate(lg, year, hitters, pitchers, hitting_cov, pitching_cov, scenarios=1000, seed=None, chunk_size=SIM_CHUNK, quantiles=SIM_QUANTILES):
+
+    # The stats in hitters and pitchers are the means. Each cov is a tuple
+    # of the stat columns to vary and their covariance, either one (k, k)
+    # matrix for everyone or a (players, k, k) stack.
+    lg = clean_request(lg)
+    rng = np.random.default_rng(seed)
+
+    hitters = load_games_by_pos(load_extra(project_stats(hitters, True, league_stats(lg, True))), lg, year, True)
+    pitchers = load_games_by_pos(load_extra(project_stats(pitchers, False, league_stats(lg, False))), lg, year, False)
+
+    hitters = simulate_values(hitters, hitting_cov, lg, True, scenarios, rng, chunk_size, quantiles)
+    pitchers = simulate_values(pitchers, pitching_cov, lg, False, scenarios, rng, chunk_size, quantiles)
+
+    df = pd.concat([hitters, pitchers], ignore_index=True)
+    df = df.sort_values(by="$", ascending=False)
+
+    return df
+
+
+def simulate_values(df, cov, lg, is_batting, scenarios, rng, chunk_size, quantiles):
+
+    if is_batting:
+        positions = lg.hitting_positions
+        num_players = lg.num_hitters
+        money = lg.teams * lg.budget * lg.hitting_split
+        stats = lg.hitting_categories if lg.scoring_type == lg.SCORING_ROTO else lg.hitting_points
+    else:
+        positions = lg.pitching_positions
+        num_players = lg.num_pitchers
+        money = lg.teams * lg.budget * (1 - lg.hitting_split)
+        stats = lg.pitching_categories if lg.scoring_type == lg.SCORING_ROTO else lg.pitching_points
+
+    df = add_missing_cols(df, stats, is_batting)
+
+    # Every scenario starts from the order the means settle in
+    start = build_values_np(df, lg, is_batting)[0].index.to_numpy()
+
+    sim = {}
+    sim["packed"] = pack_categories(df, list(stats))
+    sim["roto"] = lg.scoring_type == lg.SCORING_ROTO
+    if sim["roto"]:
+        sim["weights"] = category_weights(stats, lg.category_scales, is_batting)
+    else:
+        sim["weights"] = np.array(list(stats.values()), dtype=np.float64)
+    sim["elig"] = allocation_elig(df["elig"].to_numpy(), positions)
+    sim["catchers"] = (df["elig"].to_numpy() & POSITION_BITS["C"]) != 0
+    sim["catcher_scale"] = lg.catcher_scale
+    sim["slots"] = {position: count * lg.teams for position, count in positions.items()}
+    sim["num_players"] = num_players
+    sim["money"] = money - (lg.teams * sum(positions.values()))
+    sim["start"] = start
+
+    sim_stats, cov = cov
+    missing = [stat for stat in sim_stats if stat not in sim["packed"]["cols"]]
+    if missing:
+        raise ValueError("Can't vary stats this league doesn't use: " + ", ".join(missing))
+    rows = [sim["packed"]["cols"].index(stat) for stat in sim_stats]
+    factor = cov_factor(np.asarray(cov, dtype=np.float64))
+    means = sim["packed"]["stats"][rows].T
+
+    # Dollar values are binned as they come in, so memory doesn't grow
+    # with the number of scenarios
+    n = len(df)
+    counts = np.zeros(n * SIM_BINS, dtype=np.int64)
+    dollar_sum = np.zeros(n)
+    dollar_min = np.full(n, np.inf)
+    dollar_max = np.full(n, -np.inf)
+    rostered = np.zeros(n)
+    edges = None
+
+    for start_row in range(0, scenarios, chunk_size):
+        size = min(chunk_size, scenarios - start_row)
+
+        # Counting stats can't go below zero
+        draws = means + np.einsum("nij,snj->sni", factor, rng.standard_normal((size, n, len(rows))))
+        draws = np.maximum(draws, 0)
+
+        chunk = np.repeat(sim["packed"]["stats"][None], size, axis=0)
+        chunk[:, rows, :] = draws.transpose(0, 2, 1)
+
+        dollars, on_roster = simulate_chunk(sim, chunk)
+
+        if edges is None:
+            low, high = dollars.min(), dollars.max()
+            pad = (high - low) / 2 + 1
+            edges = (low - pad, (high - low + 2 * pad) / SIM_BINS)
+        bins = np.clip(((dollars - edges[0]) / edges[1]).astype(np.int64), 0, SIM_BINS - 1)
+        counts += np.bincount((bins + np.arange(n) * SIM_BINS).ravel(), minlength=n * SIM_BINS)
+
+        dollar_sum += dollars.sum(axis=0)
+        dollar_min = np.minimum(dollar_min, dollars.min(axis=0))
+        dollar_max = np.maximum(dollar_max, dollars.max(axis=0))
+        rostered += on_roster.sum(axis=0)
+
+    df = render_positions(df, positions, is_batting)
+    df = df[["mlbam_id", "name", "pos"]].copy()
+    df["$"] = dollar_sum / scenarios
+    for q, values in zip(quantiles, histogram_quantiles(counts.reshape(n, SIM_BINS), edges, quantiles)):
+        df["$" + str(round(q * 100))] = np.clip(values, dollar_min, dollar_max)
+    df["rostered"] = rostered / scenarios
+
+    return df
+
+
+def cov_factor(cov):
+
+    # A square root of each covariance matrix, so draws are factor @ z.
+    # Done through eigenvalues so stats with no variance are fine too.
+    if cov.ndim == 2:
+        cov = cov[None]
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+
+    return eigenvectors * np.sqrt(np.maximum(eigenvalues, 0))[:, None, :]
+
+
+def simulate_chunk(sim, stats):
+
+    # Values a batch of scenarios at once. stats is (scenario, stat, player).
+    packed = sim["packed"]
+    size = stats.shape[0]
+    num_players = sim["num_players"]
+    order = np.repeat(sim["start"][None], size, axis=0)
+
+    if not sim["roto"]:
+        total = np.einsum("m,smn->sn", sim["weights"], stats)
+        adj_total = batch_adjusted_totals(total, sim)
+        order = np.argsort(-adj_total, axis=1, kind="stable")
+    else:
+        num = np.einsum("jm,smn->sjn", packed["num_weights"], stats)
+        den = np.einsum("jm,smn->sjn", packed["den_weights"], stats)
+        adj_total = np.empty(order.shape)
+
+        # Scenarios drop out as they settle, so the ones that keep cycling
+        # don't hold the rest up
+        active = np.arange(size)
+        for _ in range(SIM_MAX_PASSES):
+            top = order[active, :num_players]
+            active_stats = stats[active]
+            avg_player = np.take_along_axis(active_stats, top[:, None, :], axis=2).mean(axis=2)
+
+            avg_num = np.where(packed["is_rate"], avg_player @ packed["num_weights"].T, 0)
+            avg_den = np.where(packed["is_rate"], avg_player @ packed["den_weights"].T, 1)
+            values = np.einsum("kj,sjn->skn", packed["comp_to_cat"], num[active] - den[active] * (avg_num / avg_den)[:, :, None])
+
+            top_values = np.take_along_axis(values, top[:, None, :], axis=2)
+            means = top_values.mean(axis=2)
+            sds = top_values.std(axis=2)
+            z = np.where(sds[:, :, None] != 0, (values - means[:, :, None]) / np.where(sds == 0, 1, sds)[:, :, None], 0)
+            total = np.einsum("k,skn->sn", sim["weights"], z)
+
+            adj_total[active] = batch_adjusted_totals(total, sim)
+            order[active] = np.argsort(-adj_total[active], axis=1, kind="stable")
+
+            # Once nobody moves in or out of the top group, the next pass
+            # would come out the same
+            moved = (np.sort(order[active, :num_players], axis=1) != np.sort(top, axis=1)).any(axis=1)
+            active = active[moved]
+            if not len(active):
+                break
+
+    top = order[:, :num_players]
+    total_points = np.take_along_axis(adj_total, top, axis=1).sum(axis=1)
+    dollars = adj_total / total_points[:, None] * sim["money"] + 1
+
+    on_roster = np.zeros(adj_total.shape, dtype=bool)
+    np.put_along_axis(on_roster, top, True, axis=1)
+
+    return dollars, on_roster
+
+
+def batch_adjusted_totals(total, sim):
+
+    # allocate_slots and adjusted_totals for a batch of scenarios at once
+    elig = sim["elig"]
+    order = np.argsort(-total, axis=1, kind="stable")
+    sorted_total = np.take_along_axis(total, order, axis=1)
+    sorted_elig = elig[order]
+    open_players = np.ones(order.shape, dtype=bool)
+
+    repl = {}
+    for position, pos_count in sim["slots"].items():
+        candidates = open_players & ((sorted_elig & position_mask(position)) != 0)
+        players = candidates & (np.cumsum(candidates, axis=1) <= pos_count)
+        open_players &= ~players
+
+        filled = players.any(axis=1)
+        repl[position] = np.where(filled, np.where(players, sorted_total, np.inf).min(axis=1), np.nan)
+        if position == "MI":
+            repl["2B"] = repl["MI"]
+            repl["SS"] = repl["MI"]
+        elif position == "CI":
+            repl["1B"] = repl["CI"]
+            repl["3B"] = repl["CI"]
+        elif position == "Util":
+            for u_pos in sim["slots"]:
+                if u_pos not in ["CI", "MI", "Util"]:
+                    used = (players & ((sorted_elig & position_mask(u_pos)) != 0)).any(axis=1)
+                    repl[u_pos] = np.where(used, repl["Util"], repl.get(u_pos, 100))
+
+    # Each player is measured against the deepest replacement level of the
+    # positions he can play, as adjusted_totals works out
+    deepest = np.full(total.shape, np.inf)
+    for position, level in repl.items():
+        if position in ["Util", "P"]:
+            deepest = np.fmin(deepest, level[:, None])
+        elif position not in ["CI", "MI"]:
+            eligible = (elig & position_mask(position)) != 0
+            deepest = np.where(eligible, np.fmin(deepest, level[:, None]), deepest)
+
+    adj_total = np.where(np.isinf(deepest), -100.0, total - deepest)
+    adj_total[:, sim["catchers"]] *= sim["catcher_scale"]
+
+    return adj_total
+
+
+def histogram_quantiles(counts, edges, quantiles):
+
+    low, width = edges
+    cumulative = np.cumsum(counts, axis=1)
+    scenarios = cumulative[:, -1]
+
+    values = []
+    for q in quantiles:
+        target = q * scenarios
+        bins = np.argmax(cumulative >= target[:, None], axis=1)
+        before = np.where(bins > 0, cumulative[np.arange(len(bins)), bins - 1], 0)
+        inside = counts[np.arange(len(bins)), bins]
+        frac = np.where(inside > 0, (target - before) / np.where(inside > 0, inside, 1), 0)
+        values.append(low + (bins + frac) * width)
+
+    return values
+
+
+def build_values(df, lg, is_batting, warm_start=None):
+    settled = False
+
+    spec = league_spec(lg).side(is_batting)
+    cats = list(spec.cats)
+    num_players = spec.num_players
+
+    if lg.scoring_type == lg.SCORING_ROTO:
+        m_cats = ["m" + cat for cat in cats]
+
+        passes = []
+        seen = {}
+        slot_cache = {}
+        cold_df = df
+        order = warm_order(df, warm_start, lg, is_batting)
+        if order is not None:
+            df = df.iloc[order].copy()
+            seen[sds_key(warm_start["sds"])] = 0
+
+        while not settled:
+            df, avg_rates = setup_stats(df, cats, num_players, is_batting)
+            df, sds, means = calc_z_scores(df, cats, num_players)
+            df = weigh_categories(df, m_cats, spec.weights)
+            df["total"] = df[m_cats].sum(axis=1)
+
+            df.sort_values(by="total", inplace=True, ascending=False)
+
+            df, repl = adjust_by_pos(df, spec.slots, lg.slot_solver, slot_cache)
+            df = scale_catchers(df, lg.catcher_scale)
+            df.sort_values(by="adj_total", inplace=True, ascending=False)
+
+            # Check if optimal grouping
+            stopped = convergence_step(passes, seen, sds, repl, lg)
+            settled = stopped is not None
+
+        note_stage(iterations=len(passes), stopped=stopped)
+
+        # A warm start that ends up cycling could stop on a different state
+        # than starting cold would, so start cold instead
+        if order is not None and stopped == "cycle":
+            return build_values(cold_df, lg, is_batting)
+
+        config = {}
+        config["cats"] = cats
+        config["sds"] = sds
+        config["means"] = means
+        config["avg_rates"] = avg_rates
+        config["rate_units"] = RATE_UNITS
+        config["repl"] = repl
+        config["convergence"] = {"iterations": len(passes), "stopped": stopped, "passes": passes}
+
+        # Clear out excess columns
+        df = cleanup_cols(df, cats, m_cats, is_batting)
+    else:
+        pts = dict(spec.points)
+        df = add_missing_cols(df, pts, is_batting)
+        df["total"] = 0.0
+        for cat, value in spec.points:
+            df["total"] += df[cat] * value
+
+        df.sort_values(by="total", inplace=True, ascending=False)
+
+        df, repl = adjust_by_pos(df, spec.slots, lg.slot_solver)
+        df = scale_catchers(df, lg.catcher_scale)
+        df.sort_values(by="adj_total", inplace=True, ascending=False)
+        config = {}
+        config["pts"] = pts
+        config["repl"] = repl
+
+    return df, config
+
+
+def build_values_np(df, lg, is_batting, history=None, warm_start=None, total=None, replay=None):
+
+    if lg.scoring_type != lg.SCORING_ROTO:
+        return build_points_values(df, lg, is_batting, total)
+
+    spec = league_spec(lg).side(is_batting)
+    cats = list(spec.cats)
+    num_players = spec.num_players
+    weights = spec.weights
+    slots = spec.slots
+
+    m_cats = ["m" + cat for cat in cats]
+
+    df = add_missing_cols(df, cats, is_batting)
+    packed = pack_categories(df, cats, spec.layout)
+
+    elig = allocation_elig(df["elig"].to_numpy(), spec.positions)
+    catchers = (df["elig"].to_numpy() & POSITION_BITS["C"]) != 0
+
+    # The first pass uses the players in the order they were given to us,
+    # unless we have earlier results to start from. Scoring against those
+    # puts everyone close to where they'll settle, and if the first pass
+    # lands on the same sds we're already done.
+    passes = []
+    seen = {}
+    slot_cache = {}
+    states = [] if history is None else history
+    ranked = np.zeros(len(df), dtype=bool)
+    order = warm_order(df, warm_start, lg, is_batting)
+    warm = order is not None
+    if warm:
+        seen[sds_key(warm_start["sds"])] = 0
+    elif replay is not None and can_replay(df, lg, is_batting, replay):
+        # Straight to the last pass of an earlier loop that's known to go
+        # the same way, from the same top group
+        order = replay_order(df, replay["top"])
+    else:
+        replay = None
+        order = np.arange(len(df))
+
+    while True:
+        top = order[:num_players]
+        avg_rates, values = calc_rate_values(packed, top)
+
+        means = values.take(top, axis=1).mean(axis=1)
+        sds = values.take(top, axis=1).std(axis=1)
+        z = calc_category_z(values, means, sds, weights)
+        total = z.sum(axis=0)
+
+        order = order[sort_order(total[order])]
+
+        assigned, repl = assign_slots(total, elig, slots, order, lg.slot_solver, slot_cache)
+        adj_total = adjusted_totals(total, elig, repl)
+        adj_total[catchers] *= lg.catcher_scale
+
+        order = order[sort_order(adj_total[order])]
+
+        if replay is not None:
+            sds = dict(zip(cats, sds.tolist()))
+            passes = list(replay["passes"])
+            stopped = replay["stopped"]
+            states = replay["states"]
+            ranked = np.isin(df["mlbam_id"].to_numpy(), replay["ranked"])
+            break
+
+        state = pass_state(avg_rates, means, sds, repl, total, adj_total, order, elig, slots, assigned, num_players, lg.slot_solver)
+        states.append(state)
+        ranked |= state_reaches(state, total, adj_total, elig)
+
+        sds = dict(zip(cats, sds.tolist()))
+        stopped = convergence_step(passes, seen, sds, repl, lg)
+        if stopped is not None:
+            break
+
+    note_stage(iterations=len(passes), stopped=stopped)
+
+    # A warm start that ends up cycling could stop on a different state
+    # than starting cold would, so start cold instead
+    if warm and stopped == "cycle":
+        states.clear()
+        return build_values_np(df, lg, is_batting, history)
+
+    config = {}
+    config["cats"] = cats
+    config["sds"] = sds
+    config["means"] = dict(zip(cats, means.tolist()))
+    config["avg_rates"] = avg_rates
+    config["rate_units"] = RATE_UNITS
+    config["repl"] = repl
+    config["convergence"] = {"iterations": len(passes), "stopped": stopped, "passes": passes}
+
+    # What recalculate needs to tell whether a change could matter. A pool
+    # from calculate_stream didn't see everyone, so its loop can't be replayed.
+    if history is None:
+        ids = df["mlbam_id"].to_numpy()
+        store_replay(replay_key(lg, is_batting, sds), {"states": states, "top": ids[top], "ranked": ids[ranked], "passes": passes, "stopped": stopped})
+
+    df = df.iloc[order].assign(
+        **{m_cat: z[i, order] for i, m_cat in enumerate(m_cats)},
+        total=total[order],
+        adj_total=adj_total[order],
+    )
+
+    df = cleanup_cols(df, cats, m_cats, is_batting)
+
+    return df, config
+
+
+def can_replay(df, lg, is_batting, replay):
+
+    # A pass with players tied at a cutoff can't be checked, and the
+    # changed players have to have been out of reach before the change
+    # and still be out of reach after it
+    if not all(state["exact"] for state in replay["states"]):
+        return False
+    if df["mlbam_id"].duplicated().any() or np.isin(replay["changed"], replay["ranked"]).any():
+        return False
+
+    return pool_is_exact(df[df["mlbam_id"].isin(replay["changed"])], replay["states"], lg, is_batting)
+
+
+_replays = OrderedDict()
+
+
+def replay_key(lg, is_batting, sds):
+
+    # A loop is known by its league and the sds it ended on
+    if not sds:
+        return None
+
+    return league_spec(lg).key, is_batting, tuple(sds.items())
+
+
+def store_replay(key, loop):
+
+    _replays[key] = loop
+    _replays.move_to_end(key)
+    while len(_replays) > REPLAY_CACHE:
+        _replays.popitem(last=False)
+
+
+def replay_order(df, top_ids):
+
+    # The earlier top group in its order, then everyone else as given
+    top = pd.Index(df["mlbam_id"]).get_indexer(top_ids)
+    rest = np.ones(len(df), dtype=bool)
+    rest[top] = False
+
+    return np.concatenate([top, np.flatnonzero(rest)])
+
+
+def warm_order(df, warm_start, lg, is_batting):
+
+    # The order to start the roto loop from, scoring everyone against an
+    # earlier config. That can be from other stats, like last year's, as
+    # long as the categories match. Only the sds and means are needed:
+    # rates default to the averages of the players in the order given,
+    # and replacement levels to zero.
+    if is_batting:
+        cats = lg.hitting_categories
+        positions = lg.hitting_positions
+        num_players = lg.num_hitters
+    else:
+        cats = lg.pitching_categories
+        positions = lg.pitching_positions
+        num_players = lg.num_pitchers
+
+    # A points config has no sds to start from
+    if warm_start is None or "sds" not in warm_start or warm_start.get("cats", cats) != cats:
+        return None
+
+    seed = {"cats": cats, "repl": {position: 0.0 for position in positions}}
+    seed.update(warm_start)
+    if "avg_rates" in seed:
+        seed["avg_rates"] = config_rates(seed)
+    else:
+        df = add_missing_cols(df, cats, is_batting)
+        seed["avg_rates"] = calc_rate_values(pack_categories(df, cats), np.arange(min(num_players, len(df))))[0]
+
+    return sort_order(score_values(df, seed, lg, is_batting)["adj_total"].to_numpy())
+
+
+def convergence_step(passes, seen, sds, repl, lg):
+
+    # Records a pass of the roto loop and says why it should stop, if it
+    # should. seen maps each earlier pass's sds to its number, so repeats
+    # are found by hash rather than by comparing every pass.
+    step = {"pass": len(passes) + 1, "sds": sds, "repl": repl}
+    if passes:
+        step["sd_change"] = max_change(passes[-1]["sds"], sds, relative=True)
+        step["repl_change"] = max_change(passes[-1]["repl"], repl)
+    passes.append(step)
+
+    # Landing on the same sds as the pass before is a fixed point. Landing
+    # on an older pass's means we're going around in a cycle.
+    key = sds_key(sds)
+    if key in seen:
+        return "settled" if seen[key] == len(passes) - 1 else "cycle"
+    seen[key] = len(passes)
+
+    tolerance = lg.convergence_tolerance
+    if tolerance > 0 and len(passes) > 1 and step["sd_change"] <= tolerance and step["repl_change"] <= tolerance:
+        return "tolerance"
+
+    if len(passes) >= lg.max_iterations:
+        return "max_iterations"
+
+    return None
+
+
+def sds_key(sds):
+
+    return tuple(float(format(sd, "." + str(SDS_DIGITS) + "g")) for sd in sds.values())
+
+
+def max_change(before, after, relative=False):
+
+    changes = []
+    for key, value in after.items():
+        if key not in before or np.isnan(value) or np.isnan(before[key]):
+            continue
+        change = abs(value - before[key])
+        if relative and before[key] != 0:
+            change /= abs(before[key])
+        changes.append(float(change))
+
+    return max(changes, default=0.0)
+
+
+def build_points_values(df, lg, is_batting, total=None):
+
+    if is_batting:
+        pts = lg.hitting_points
+        pos = lg.hitting_positions
+    else:
+        pts = lg.pitching_points
+        pos = lg.pitching_positions
+
+    df = add_missing_cols(df, pts, is_batting)
+    if total is None:
+        total = points_totals(df, [pts])[:, 0]
+
+    elig = allocation_elig(df["elig"].to_numpy(), pos)
+    slots = league_spec(lg).side(is_batting).slots
+
+    order = sort_order(total)
+    _, repl = assign_slots(total, elig, slots, order, lg.slot_solver)
+    adj_total = adjusted_totals(total, elig, repl)
+    adj_total[(df["elig"].to_numpy() & POSITION_BITS["C"]) != 0] *= lg.catcher_scale
+    order = order[sort_order(adj_total[order])]
+
+    config = {}
+    config["pts"] = pts
+    config["repl"] = repl
+
+    df = df.iloc[order].assign(total=total[order], adj_total=adj_total[order])
+
+    return df, config
+
+
+def points_totals(df, pts_list):
+
+    # Every league's stats as columns of one matrix, with a column of zeros
+    # to pad out the leagues that score fewer stats
+    cols = list(dict.fromkeys(col for pts in pts_list for col in pts))
+    stats = np.zeros((len(df), len(cols) + 1))
+    stats[:, :-1] = df[cols].to_numpy(dtype=np.float64)
+
+    depth = max(len(pts) for pts in pts_list)
+    index = np.full((depth, len(pts_list)), len(cols))
+    weights = np.zeros((depth, len(pts_list)))
+    for i, pts in enumerate(pts_list):
+        index[:len(pts), i] = [cols.index(col) for col in pts]
+        weights[:len(pts), i] = list(pts.values())
+
+    # All the leagues are added up together, a stat at a time in each
+    # league's own order. That's the order the single league loop adds in,
+    # and unlike a BLAS product identical stat lines always come out with
+    # identical totals.
+    totals = np.zeros((len(df), len(pts_list)))
+    for j in range(depth):
+        totals += stats[:, index[j]] * weights[j]
+
+    return totals
+
+
+def pass_state(avg_rates, means, sds, repl, total, adj_total, order, elig, slots, assigned, num_players, solver=SLOT_GREEDY):
+
+    # Everything about one pass of the loop that decides who the next pass
+    # looks at. exact is False when players tie right at one of the cutoffs,
+    # since then the order they happen to be in decides who makes it.
+    state = {}
+    state["avg_rates"] = avg_rates
+    state["means"] = means
+    state["sds"] = sds
+    state["repl"] = repl
+    state["exact"] = True
+
+    if num_players < len(order):
+        state["cutoff"] = adj_total[order[num_players - 1]]
+        state["exact"] = adj_total[order[num_players]] != state["cutoff"]
+    else:
+        state["cutoff"] = -np.inf
+
+    state["floors"] = {}
+
+    # The optimal solver can shuffle players between positions to make room
+    # for someone, so anyone better than the worst player on a roster
+    # could have changed it
+    if solver == SLOT_OPTIMAL:
+        on_roster = assigned >= 0
+        floor = total[on_roster].min() if on_roster.sum() == sum(slots.values()) else -np.inf
+        for position in slots:
+            state["floors"][position] = floor
+        state["exact"] &= not ((total == floor) & ~on_roster).any()
+        return state
+
+    for i, (position, pos_count) in enumerate(slots.items()):
+        filled = assigned == i
+        if filled.sum() < pos_count:
+            state["floors"][position] = -np.inf
+        else:
+            floor = total[filled].min()
+            eligible = (elig & position_mask(position)) != 0
+            state["floors"][position] = floor
+            state["exact"] &= not ((total == floor) & eligible & ~filled).any()
+
+    return state
+
+
+def pool_is_exact(tail, history, lg, is_batting, ties=True):
+
+    spec = league_spec(lg).side(is_batting)
+    packed = pack_categories(tail, spec.cats, spec.layout)
+    weights = spec.weights
+    elig = allocation_elig(tail["elig"].to_numpy(), spec.positions)
+    catchers = (tail["elig"].to_numpy() & POSITION_BITS["C"]) != 0
+
+    # Without ties, only players strictly past a cutoff count against the pool
+    reaches = np.greater_equal if ties else np.greater
+
+    for state in history:
+        values = rate_values(packed, state["avg_rates"])
+        total = calc_category_z(values, state["means"], state["sds"], weights).sum(axis=0)
+
+        adj_total = adjusted_totals(total, elig, state["repl"])
+        adj_total[catchers] *= lg.catcher_scale
+        if state_reaches(state, total, adj_total, elig, reaches).any():
+            return False
+
+    return True
+
+
+def state_reaches(state, total, adj_total, elig, reaches=np.greater_equal):
+
+    # Who makes the top group of a pass or gets to a roster floor
+    reached = reaches(adj_total, state["cutoff"])
+    for position, floor in state["floors"].items():
+        reached |= reaches(total, floor) & ((elig & position_mask(position)) != 0)
+
+    return reached
+
+
+def top_indexes(values, count):
+
+    if count <= 0:
+        return np.arange(0)
+    if count >= len(values):
+        return np.arange(len(values))
+
+    return np.argpartition(-np.nan_to_num(values, nan=-np.inf), count - 1)[:count]
+
+
+def score_values(df, lg_stats, lg, is_batting):
+
+    # Score players against the results of an earlier valuation
+    cats = lg_stats["cats"]
+    m_cats = ["m" + cat for cat in cats]
+
+    df = add_missing_cols(df, cats, is_batting)
+    values = rate_values(pack_categories(df, cats), lg_stats["avg_rates"])
+
+    means = np.array([lg_stats["means"][cat] for cat in cats])
+    sds = np.array([lg_stats["sds"][cat] for cat in cats])
+    z = calc_category_z(values, means, sds, category_weights(cats, lg.category_scales, is_batting))
+    total = z.sum(axis=0)
+
+    positions = lg.hitting_positions if is_batting else lg.pitching_positions
+    elig = allocation_elig(df["elig"].to_numpy(), positions)
+    adj_total = adjusted_totals(total, elig, lg_stats["repl"])
+    adj_total[(df["elig"].to_numpy() & POSITION_BITS["C"]) != 0] *= lg.catcher_scale
+
+    df = df.assign(**{m_cat: z[i] for i, m_cat in enumerate(m_cats)}, total=total, adj_total=adj_total)
+
+    return cleanup_cols(df, cats, m_cats, is_batting)
+
+
+_category_layouts = OrderedDict()
+
+
+def category_layout(cats):
+
+    # Which stats each category is built from only depends on the
+    # categories, so it's worked out once for each set of them
+    cats = tuple(cats)
+    if cats in _category_layouts:
+        _category_layouts.move_to_end(cats)
+        return _category_layouts[cats]
+
+    # Every category is made up of one or more components. A counting
+    # component is just its numerator. A rate component is its numerator
+    # minus its denominator at the league average rate.
+    components = []
+    comp_cats = []
+    for i, cat in enumerate(cats):
+        if cat in COMBINED_RATE_STATS:
+            for rate in COMBINED_RATE_STATS[cat]:
+                components.append((rate,) + RATE_STATS[rate])
+                comp_cats.append(i)
+        elif cat in RATE_STATS:
+            components.append((cat,) + RATE_STATS[cat])
+            comp_cats.append(i)
+        else:
+            components.append((None, [cat], []))
+            comp_cats.append(i)
+
+    cols = []
+    for _, num, den in components:
+        for col in num + den:
+            if col not in cols:
+                cols.append(col)
+
+    num_weights = np.zeros((len(components), len(cols)))
+    den_weights = np.zeros((len(components), len(cols)))
+    for j, (_, num, den) in enumerate(components):
+        num_weights[j, [cols.index(col) for col in num]] = 1
+        den_weights[j, [cols.index(col) for col in den]] = 1
+
+    comp_to_cat = np.zeros((len(cats), len(components)))
+    comp_to_cat[comp_cats, np.arange(len(components))] = 1
+
+    layout = {}
+    layout["cats"] = list(cats)
+    layout["cols"] = cols
+    layout["rates"] = [(rate, [cols.index(col) for col in num], [cols.index(col) for col in den]) for rate, num, den in components if rate is not None]
+    layout["is_rate"] = np.array([rate is not None for rate, _, _ in components], dtype=bool)
+    layout["comp_to_cat"] = comp_to_cat
+    layout["num_weights"] = num_weights
+    layout["den_weights"] = den_weights
+    for array in layout.values():
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+
+    _category_layouts[cats] = MappingProxyType(layout)
+    while len(_category_layouts) > LEAGUE_SPEC_CACHE:
+        _category_layouts.popitem(last=False)
+
+    return _category_layouts[cats]
+
+
+def pack_categories(df, cats, layout=None):
+
+    if layout is None:
+        layout = category_layout(cats)
+
+    # Stats are stored a column per row, so each stat is contiguous
+    packed = dict(layout)
+    packed["stats"] = np.ascontiguousarray(df[layout["cols"]].fillna(0).to_numpy(dtype=np.float64).T)
+    packed["num"] = np.ascontiguousarray(layout["num_weights"] @ packed["stats"])
+    packed["den"] = np.ascontiguousarray(layout["den_weights"] @ packed["stats"])
+
+    return packed
+
+
+def calc_rate_values(packed, top):
+
+    avg_player = packed["stats"].take(top, axis=1).mean(axis=1)
+
+    # Each rate component is scaled by its numerator and denominator
+    # averages, in the same order that calc_rate_stat applies them
+    avg_num = np.zeros(len(packed["is_rate"]))
+    avg_den = np.ones(len(packed["is_rate"]))
+    avg_num[packed["is_rate"]] = [avg_player[num].sum() for _, num, _ in packed["rates"]]
+    avg_den[packed["is_rate"]] = [avg_player[den].sum() for _, _, den in packed["rates"]]
+
+    values = packed["num"] - (packed["den"] * avg_num[:, None] / avg_den[:, None])
+    values = packed["comp_to_cat"] @ values
+
+    avg_rates = {}
+    for (rate, _, _), num, den in zip(packed["rates"], avg_num[packed["is_rate"]], avg_den[packed["is_rate"]]):
+        avg_rates[rate] = num / den
+    for cat, combined in COMBINED_RATE_STATS.items():
+        if cat in packed["cats"]:
+            avg_rates[cat] = sum(avg_rates[rate] for rate in combined)
+
+    return avg_rates, values
+
+
+def config_rates(lg_stats):
+
+    # A config saved when innings were counted as decimals has its pitching
+    # rates per inning, so they're put in outs to score the same
+    units = lg_stats.get("rate_units", "innings")
+    if units == RATE_UNITS:
+        return lg_stats["avg_rates"]
+    elif units != "innings":
+        raise ValueError("Unknown rate_units " + str(units))
+
+    return {rate: value / 3 if RATE_STATS.get(rate, (None, None))[1] == ["OUTS"] else value for rate, value in lg_stats["avg_rates"].items()}
+
+
+def rate_values(packed, avg_rates):
+
+    # Category values at fixed league average rates
+    rates = np.zeros(len(packed["is_rate"]))
+    rates[packed["is_rate"]] = [avg_rates[rate] for rate, _, _ in packed["rates"]]
+
+    return packed["comp_to_cat"] @ (packed["num"] - packed["den"] * rates[:, None])
+
+
+def category_weights(cats, cat_scales, is_batting):
+
+    signs = np.array([-1.0 if cat in negative_cats(is_batting) else 1.0 for cat in cats])
+    scales = np.array([cat_scales.get(cat, 1.0) for cat in cats])
+
+    return signs * scales
+
+
+def calc_category_z(values, means, sds, weights):
+
+    z = np.zeros_like(values)
+    nonzero = sds != 0
+    z[nonzero] = (values[nonzero] - means[nonzero, None]) / sds[nonzero, None]
+
+    return z * weights[:, None]
+
+
+def sort_order(values):
+
+    # A descending sort that breaks ties the same way DataFrame.sort_values
+    # does, so both engines settle on the same group of players
+    nans = np.isnan(values)
+    idx = np.flatnonzero(~nans)[::-1]
+    idx = idx[values[idx].argsort(kind="quicksort")][::-1]
+
+    return np.concatenate([idx, np.flatnonzero(nans)])
+
+
+def clean_request(lg):
+
+    # A cleaned copy, so the caller's League is left as it was
+    lg = copy.copy(lg)
+
+    # Remove any positions with a value of 0
+    lg.hitting_positions = {k: v for k, v in lg.hitting_positions.items() if v}
+    lg.pitching_positions = {k: v for k, v in lg.pitching_positions.items() if v}
+
+    lg.hitting_categories = [HITTING_ALIASES.get(cat, cat) for cat in lg.hitting_categories]
+    lg.pitching_categories = [PITCHING_ALIASES.get(cat, cat) for cat in lg.pitching_categories]
+
+    return lg
+
+
+def setup_stats(df, cats, num_players, is_batting):
+
+    df = add_missing_cols(df, cats, is_batting)
+    df, avg_rates = calc_rate_stats(df, cats, num_players)
+
+    return df, avg_rates
+
+
+def project_stats(df, is_batting, stats=(), decimal=False):
+
+    # The pipeline works on its own frame with just the columns it can use,
+    # so the caller's DataFrame is never changed. Derived stats are left
+    # out and worked out again, and innings become outs. decimal says IP
+    # isn't in baseball notation, when that's been decided for a whole file.
+    derived = derived_stats(is_batting)
+    cols = [col for col in df.columns if (col in ID_COLUMNS or col in STAT_SCHEMA or col in stats) and col not in derived]
+    projected = df.reindex(columns=cols)
+
+    if not is_batting and "OUTS" not in projected and "IP" in df:
+        projected["OUTS"] = pitching_outs(df["IP"], decimal)
+
+    return projected
+
+
+def derived_stats(is_batting):
+
+    # A stat only pitchers work out, like AB, is still one of a hitter's own
+    return [stat for stat in DERIVED_STATS if not (is_batting and stat in STAT_SCHEMA and DERIVED_SIDES.get(stat) is False)]
 
-    # If we have SDs, then this is a roto league
-    if "cats" in lg_stats.keys():
-        
-        df = add_missing_cols(df, lg_stats["cats"], is_batting)
-        # Calculate and combine z-scores
-        for cat in lg_stats["cats"]:
-            if cat in lg_stats["avg_rates"]:
-                if cat == "AVG":
-                    df["mAVG"] = (df["H"] - (df["AB"] * lg_stats["avg_rates"]["AVG"])) / lg_stats["sds"]["AVG"]
-                elif cat == "OBP":
-                    df["mOBP"] = ((df["H"] + df["BB"] + df["HBP"]) - (df["AB"] + df["BB"] + df["HBP"] + df["SF"]) * lg_stats["avg_rates"]["OBP"]) / lg_stats["sds"]["OBP"]
-                elif cat == "SLG":
-                    df["mSLG"] = ((df["H"] + df["2B"] + df["3B"]*2 + df["HR"]*3) - (df["AB"] * lg_stats["avg_rates"]["SLG"])) / lg_stats["sds"]["SLG"]
-                elif cat == "OPS":
-                    df["mOPS"] = (
-                        ((df["H"] + df["BB"] + df["HBP"]) - (df["AB"] + df["BB"] + df["HBP"] + df["SF"]) * lg_stats["avg_rates"]["OBP"]) +
-                        ((df["H"] + df["2B"] + df["3B"]*2 + df["HR"]*3) - (df["AB"] * lg_stats["avg_rates"]["SLG"]))
-                    ) / lg_stats["sds"]["OPS"]
-                elif cat == "ERA":
-                    df["mERA"] = (df["ER"] - (df["IP"] * lg_stats["avg_rates"]["ERA"])) / lg_stats["sds"]["ERA"]
-                elif cat == "WHIP":
-                    df["mWHIP"] = ((df["H"] + df["BB"]) - (df["IP"] * lg_stats["avg_rates"]["WHIP"])) / lg_stats["sds"]["WHIP"]
-                elif cat == "K/9":
-                    df["mK/9"] = (df["SO"] - (df["IP"] * lg_stats["avg_rates"]["K/9"])) / lg_stats["sds"]["K/9"]
-                elif cat == "BB/9":
-                    df["mBB/9"] = (df["BB"] - (df["IP"] * lg_stats["avg_rates"]["BB/9"])) / lg_stats["sds"]["BB/9"]
-                elif cat == "K/BB":
-                    df["mK/BB"] = (df["SO"] - (df["BB"] * lg_stats["avg_rates"]["K/BB"])) / lg_stats["sds"]["K/BB"]
-                elif cat == "HR/9":
-                    df["mHR/9"] = (df["HR"] - (df["IP"] * lg_stats["avg_rates"]["HR/9"])) / lg_stats["sds"]["HR/9"]
-            else:
-                df["m" + cat] = (df[cat] - lg_stats["means"][cat]) / lg_stats["sds"][cat]
-        
-        flip_negative_cats(df, lg_stats["sds"].keys(), is_batting)
 
-        df["total"] = 0
-        for cat in lg_stats["cats"]:
-            df["total"] += df["m" + cat]
-    
-    # Points leagues
-    else:
-        df = add_missing_cols(df, lg_stats["pts"], is_batting)
-        df["total"] = 0
-        for cat, value in lg_stats["pts"].items():
-            df["total"] += df[cat] * value
+def derive_stat(name, expression, is_batting=None):
 
-    # Adjust for position
-    df["pos"].replace("DH", "Util", inplace=True)
-    df["pos"].replace(["LF","CF","RF"], "OF", inplace=True)
+    # Adds a stat worked out from others, like derive_stat("K-BB", "SO - BB", False),
+    # that leagues can then use as a category or score points for. It's for
+    # both hitters and pitchers unless is_batting says which. It can only
+    # read stats we load or work out, so a typo fails here, not when a
+    # league is valued.
+    _, deps = stat_formula(expression)
+    unknown = [stat for stat in deps if stat not in STAT_SCHEMA and stat not in DERIVED_STATS and stat != name]
+    if unknown:
+        raise ValueError("Derived stat " + name + " reads unknown stats: " + ", ".join(unknown))
 
-    # We'll count a player as SP if he starts at least half of his games
-    if not is_batting:
-        if "SP" in lg_stats["repl"]:
-            df["pos"] = np.where((df.GS >= (df.G / 2)), "SP", "RP")
+    DERIVED_STATS[name] = expression
+    if is_batting is None:
+        DERIVED_SIDES.pop(name, None)
+    else:
+        DERIVED_SIDES[name] = is_batting
 
-    df["repl"] = df["pos"].map(lg_stats["repl"])
-    df["adj_total"] = df["total"] - df["repl"]
+    _derived_plans.clear()
+    clear_result_cache()
 
-    if "cats" in lg_stats.keys():
-        df = calculate_rate_stats(df, lg_stats["cats"])
-        for cat in lg_stats["cats"]:
-            df = round_column(df, cat, cat)
 
-    # Convert to dollar value
-    df["$"] = df["adj_total"] * lg_stats["dollar_rate"] + 1
+_stat_formulas = {}
 
-    return df
 
+def stat_formula(expression):
 
-def build_values(df, lg, is_batting):
-    settled = False
-    previous_sds = []
-    previous_means = []
-    previous_rep_levels = []
+    # An expression compiled once, with the stats it reads
+    if expression in _stat_formulas:
+        return _stat_formulas[expression]
 
-    if is_batting:
-        if lg.scoring_type == lg.SCORING_ROTO:
-            cats = lg.hitting_categories
+    parts = []
+    deps = []
+    end = 0
+    for match in STAT_TOKEN.finditer(expression):
+        if match.start() != end:
+            break
+        number, stat, operator = match.groups()
+        if stat is not None:
+            if stat not in deps:
+                deps.append(stat)
+            parts.append("s[" + str(deps.index(stat)) + "]")
         else:
-            pts = lg.hitting_points
-        pos = lg.hitting_positions
-        num_players = lg.num_hitters
-    else:
-        if lg.scoring_type == lg.SCORING_ROTO:
-            cats = lg.pitching_categories
-        else:
-            pts = lg.pitching_points
-        pos = lg.pitching_positions
-        num_players = lg.num_pitchers
+            parts.append(number or operator)
+        end = match.end()
 
-    if lg.scoring_type == lg.SCORING_ROTO:
-        m_cats = ["m" + cat for cat in cats]
+    if end != len(expression.rstrip()) or not parts:
+        raise ValueError("Can't read derived stat expression: " + expression)
 
-        while not settled:
-            df, avg_rates = setup_stats(df, cats, num_players, is_batting)
-            df, sds, means = calc_z_scores(df, cats, num_players)
-            df = flip_negative_cats(df, cats, is_batting)
+    try:
+        code = compile(" ".join(parts), "<" + expression + ">", "eval")
+    except SyntaxError:
+        raise ValueError("Can't read derived stat expression: " + expression)
 
-            df = scale_categories(df, cats, lg.category_scales)
-            df["total"] = df[m_cats].sum(axis=1)
+    _stat_formulas[expression] = (code, deps)
 
-            df.sort_values(by="total", inplace=True, ascending=False)
+    return _stat_formulas[expression]
 
-            df, repl = adjust_by_pos(df, pos, lg.teams)
-            df = scale_catchers(df, lg.catcher_scale)
-            df.sort_values(by="adj_total", inplace=True, ascending=False)
 
-            # Check if optimal grouping
-            if sds in previous_sds:
-                settled = True
+def stat_inputs(stat):
 
-            previous_sds.append(sds)
-            previous_means.append(means)
-            previous_rep_levels.append(repl)
+    # The columns a category or points stat is built from
+    if stat in COMBINED_RATE_STATS:
+        return [col for rate in COMBINED_RATE_STATS[stat] for part in RATE_STATS[rate] for col in part]
+    if stat in RATE_STATS:
+        return RATE_STATS[stat][0] + RATE_STATS[stat][1]
 
-        config = {}
-        config["cats"] = cats
-        config["sds"] = sds
-        config["means"] = means
-        config["avg_rates"] = avg_rates
-        config["repl"] = repl
+    return [stat]
 
-        # Clear out excess columns
-        df = cleanup_cols(df, cats, m_cats, is_batting)
-    else:
-        df = add_missing_cols(df, pts, is_batting)
-        df["total"] = 0.0
-        for cat, value in pts.items():
-            df["total"] += df[cat] * value
 
-        df.sort_values(by="total", inplace=True, ascending=False)
+_derived_plans = OrderedDict()
 
-        df, repl = adjust_by_pos(df, pos, lg.teams)
-        df = scale_catchers(df, lg.catcher_scale)
-        df.sort_values(by="adj_total", inplace=True, ascending=False)
-        config = {}
-        config["pts"] = pts
-        config["repl"] = repl
 
-    return df, config
+def derived_plan(stats, is_batting, columns):
 
-def clean_request(lg):
+    # Which missing stats count as zero and which derived stats get worked
+    # out, in order, for these stats on a frame with these columns. Only
+    # what the stats need is worked out, each after the stats it reads.
+    key = (tuple(stats), is_batting, tuple(columns))
+    if key in _derived_plans:
+        _derived_plans.move_to_end(key)
+        return _derived_plans[key]
 
-    # Remove any positions with a value of 0
-    lg.hitting_positions = {k: v for k, v in lg.hitting_positions.items() if v}
-    lg.pitching_positions = {k: v for k, v in lg.pitching_positions.items() if v}
+    formulas = {stat: expression for stat, expression in DERIVED_STATS.items() if DERIVED_SIDES.get(stat, is_batting) == is_batting}
+    have = set(columns)
+    needed = set()
+    visiting = []
 
-    if "K" in lg.hitting_categories:
-        lg.hitting_categories[lg.hitting_categories.index("K")] = "SO"
+    def need(stat):
+        if stat in have or stat in needed:
+            return
+        if stat in visiting:
+            raise ValueError("Derived stat " + stat + " is worked out from itself")
+        if stat in formulas:
+            visiting.append(stat)
+            for dep in stat_formula(formulas[stat])[1]:
+                need(dep)
+            visiting.pop()
+        needed.add(stat)
 
-    if "DB" in lg.hitting_categories:
-        lg.hitting_categories[lg.hitting_categories.index("DB")] = "2B"
+    for stat in ALWAYS_STATS[is_batting] + list(stats):
+        for col in stat_inputs(stat):
+            need(col)
 
-    if "TP" in lg.hitting_categories:
-        lg.hitting_categories[lg.hitting_categories.index("TP")] = "3B"
+    # Kept in the order they're listed, with anything a stat reads first
+    steps = []
 
-    if "K" in lg.pitching_categories:
-        lg.pitching_categories[lg.pitching_categories.index("K")] = "SO"
+    def add(stat):
+        if stat in steps:
+            return
+        for dep in stat_formula(formulas[stat])[1]:
+            if dep in needed and dep in formulas:
+                add(dep)
+        steps.append(stat)
 
-    if "S" in lg.pitching_categories:
-        lg.pitching_categories[lg.pitching_categories.index("S")] = "SV"
+    for stat in formulas:
+        if stat in needed:
+            add(stat)
 
-    if "BAA" in lg.pitching_categories:
-        lg.pitching_categories[lg.pitching_categories.index("BAA")] = "AVG"
+    zeros = [stat for stat in ZERO_STATS if stat in needed and stat not in formulas]
+    plan = (zeros, [(stat,) + stat_formula(formulas[stat]) for stat in steps])
 
-    return lg
+    _derived_plans[key] = plan
+    while len(_derived_plans) > LEAGUE_SPEC_CACHE:
+        _derived_plans.popitem(last=False)
 
+    return plan
 
-def setup_stats(df, cats, num_players, is_batting):
 
-    df = add_missing_cols(df, cats, is_batting)
-    df, avg_rates = calc_rate_stats(df, cats, num_players)
+def league_stats(lg, is_batting):
 
-    return df, avg_rates
+    if lg.scoring_type == lg.SCORING_ROTO:
+        return lg.hitting_categories if is_batting else lg.pitching_categories
+    else:
+        return list(lg.hitting_points if is_batting else lg.pitching_points)
 
 
 def add_missing_cols(df, cats, is_batting):
 
-    if "HBP" not in df:
-        df["HBP"] = 0
-    if "SF" not in df:
-        df["SF"] = 0
-    if "HLD" in cats and not "HLD" in df:
-        df["HLD"] = 0
-    if "SV+HLD" in cats and not "HLD" in df:
-        df["HLD"] = 0
-    if "SV+HLD/2" in cats and not "HLD" in df:
-        df["HLD"] = 0
-    if "QS" in cats and not "QS" in df:
-        df["QS"] = 0
-    if "W+QS" in cats and not "QS" in df:
-        df["QS"] = 0
-    if "W+QS-L" in cats and not "QS" in df:
-        df["QS"] = 0
+    if not is_batting and "OUTS" not in df:
+        df["OUTS"] = pitching_outs(df["IP"])
+
+    zeros, steps = derived_plan(cats, is_batting, df.columns)
+
+    for stat in zeros:
+        df[stat] = 0
     if not is_batting and not "R" in df:
         df["R"] = df["ER"]
 
-    if is_batting:
-        df["PA"] = df["AB"] + df["BB"] + df["HBP"] + df["SF"]
-
-    if "TB" in cats or "SLG" in cats or "OPS" in cats:
-        df["TB"] = df["H"] + df["2B"] + (df["3B"] * 2) + (df["HR"] * 3)
-    if "1B" in cats:
-        df["1B"] = df["H"] - df["2B"] - df["3B"] - df["HR"]
-    if "xBH" in cats:
-        df["xBH"] = df["2B"] + df["3B"] + df["HR"]
-    if "RBI+R" in cats:
-        df["RBI+R"] = df["RBI"] + df["R"]
-    if "SB-CS" in cats:
-        df["SB-CS"] = df["SB"] - df["CS"]
-    if "W-L" in cats:
-        df["W-L"] = df["W"] - df["L"]
-    if "W+QS" in cats:
-        df["W+QS"] = df["W"] + df["QS"]
-    if "W+QS-L" in cats:
-        df["W+QS-L"] = df["W"] + df["QS"] - df["L"]
-    if "SV+HLD" in cats:
-        df["SV+HLD"] = df["SV"] + df["HLD"]
-    if "SV+HLD/2" in cats:
-        df["SV+HLD/2"] = df["SV"] + df["HLD"] / 2
-
-    if not is_batting and "AVG" in cats:
-        df["AB"] = df["IP"] * 3 - df["BB"] - df["HBP"] - df["SF"]
+    # Derived stats are only worked out once. The frames here are our own
+    # projections of the input, which never carry them in.
+    for stat, code, deps in steps:
+        df[stat] = eval(code, {"__builtins__": {}}, {"s": [df[dep] for dep in deps]})
 
     return df
 
@@ -483,28 +2819,28 @@ def calc_rate_stats(df, cats, num_players):
         avg_rates["OPS"] = avg_rates["OBP"] + avg_rates["SLG"]
 
     if "ERA" in cats:
-        df["ERA"] = calc_rate_stat(df, ["ER"], ["IP"], avg_player)
-        avg_rates["ERA"] = avg_player["ER"] / avg_player["IP"]
+        df["ERA"] = calc_rate_stat(df, ["ER"], ["OUTS"], avg_player)
+        avg_rates["ERA"] = avg_player["ER"] / avg_player["OUTS"]
 
     if "WHIP" in cats:
-        df["WHIP"] = calc_rate_stat(df, ["H", "BB"], ["IP"], avg_player)
-        avg_rates["WHIP"] = (avg_player["H"] + avg_player["BB"]) / avg_player["IP"]
+        df["WHIP"] = calc_rate_stat(df, ["H", "BB"], ["OUTS"], avg_player)
+        avg_rates["WHIP"] = (avg_player["H"] + avg_player["BB"]) / avg_player["OUTS"]
 
     if "K/9" in cats:
-        df["K/9"] = calc_rate_stat(df, ["SO"], ["IP"], avg_player)
-        avg_rates["K/9"] = avg_player["SO"] / avg_player["IP"]
+        df["K/9"] = calc_rate_stat(df, ["SO"], ["OUTS"], avg_player)
+        avg_rates["K/9"] = avg_player["SO"] / avg_player["OUTS"]
 
     if "BB/9" in cats:
-        df["BB/9"] = calc_rate_stat(df, ["BB"], ["IP"], avg_player)
-        avg_rates["BB/9"] = avg_player["BB"] / avg_player["IP"]
+        df["BB/9"] = calc_rate_stat(df, ["BB"], ["OUTS"], avg_player)
+        avg_rates["BB/9"] = avg_player["BB"] / avg_player["OUTS"]
 
     if "K/BB" in cats:
         df["K/BB"] = calc_rate_stat(df, ["SO"], ["BB"], avg_player)
         avg_rates["K/BB"] = avg_player["SO"] / avg_player["BB"]
 
     if "HR/9" in cats:
-        df["HR/9"] = calc_rate_stat(df, ["HR"], ["IP"], avg_player)
-        avg_rates["HR/9"] = avg_player["HR"] / avg_player["IP"]
+        df["HR/9"] = calc_rate_stat(df, ["HR"], ["OUTS"], avg_player)
+        avg_rates["HR/9"] = avg_player["HR"] / avg_player["OUTS"]
 
     return df, avg_rates
 
@@ -531,64 +2867,64 @@ def calc_z_scores(df, cats, num_players):
     return df, sds, means
 
 
-def flip_negative_cats(df, cats, is_batting):
-    
+def weigh_categories(df, m_cats, weights):
+
+    # Negative categories flip sign, and scaled ones count for more or less
+    df[m_cats] = df[m_cats] * weights
+
+    return df
+
+def negative_cats(is_batting):
+
     if is_batting:
-        negative_cats = ["SO"]
+        return ["SO"]
     else:
-        negative_cats = ["ERA","WHIP","AVG","BB/9","HR/9","HR","L"]
-    
-    for cat in cats:
-        if cat in negative_cats:
-            df["m" + cat] *= -1
+        return ["ERA","WHIP","AVG","BB/9","HR/9","HR","L"]
 
-    return df
+def adjust_by_pos(df, slots, solver=SLOT_GREEDY, cache=None):
+
+    elig = allocation_elig(df["elig"].to_numpy(), slots)
+    total = df["total"].to_numpy()
 
-def scale_categories(df, cats, cat_scales):
+    # The players are already sorted by total
+    _, repl = assign_slots(total, elig, slots, np.arange(len(df)), solver, cache)
+    df["adj_total"] = adjusted_totals(total, elig, repl)
+
+    return df, repl
+
+def scale_catchers(df, catcher_scale):
 
-    for cat, scale in cat_scales.items():
-        if cat in cats:
-            if cat in df:
-                df["m" + cat] = df["m" + cat] * scale
+    df.loc[(df["elig"] & POSITION_BITS["C"]) != 0, "adj_total"] = df["adj_total"] * catcher_scale
 
     return df
 
 
-def adjust_by_pos(df, positions, teams):
+def position_mask(position):
 
-    repl = {position: 100 for position in positions}
-    df["counted"] = False
-    df["adj_total"] = -100
+    if position in POSITION_MASKS:
+        return POSITION_MASKS[position]
 
-    # For this process, we'll count P as SP if this league doesn't use P
-    df["actual_pos"] = df["pos"]
-    if "SP" in positions and "P" not in positions:
-        df.loc[df["pos"] == "", "pos"] = "SP"
+    return POSITION_BITS.get(position, 0)
 
-    for position in positions:
-        pos_count = positions[position] * teams
 
-        # Only look at players who are eligible at this position
-        if position == "MI":
-            df_pos = df[df["pos"].str.contains("2B|SS")]
-        elif position == "CI":
-            df_pos = df[df["pos"].str.contains("1B|3B")]
-        elif position in ["Util", "P"]:
-            df_pos = df
-        else:
-            df_pos = df[df["pos"].str.contains(position)]
+def allocate_slots(totals, elig, slots, order=None):
 
-        # And only look at players that we haven't counted for other positions
-        df_pos = df_pos[df_pos["counted"] == False]
+    # Fill each position in turn with the best eligible players that
+    # haven't been counted elsewhere. assigned holds the index of the
+    # position each player fills, or -1 if he doesn't make a roster.
+    if order is None:
+        order = sort_order(totals)
 
-        # And only players who are above replacement
-        df_pos = df_pos.head(pos_count)
+    repl = {position: 100 for position in slots}
+    assigned = np.full(len(totals), -1)
 
-        df_pos["counted"] = True
-        df.update(df_pos)
+    for i, (position, pos_count) in enumerate(slots.items()):
+        open_players = order[assigned[order] == -1]
+        players = open_players[(elig[open_players] & position_mask(position)) != 0][:pos_count]
+        assigned[players] = i
 
         # Save our replacement level for this position
-        repl[position] = df_pos["total"].min()
+        repl[position] = totals[players].min() if len(players) else np.nan
         if position == "MI":
             repl["2B"] = repl["MI"]
             repl["SS"] = repl["MI"]
@@ -596,34 +2932,188 @@ def adjust_by_pos(df, positions, teams):
             repl["1B"] = repl["CI"]
             repl["3B"] = repl["CI"]
         elif position == "Util":
-            for u_pos in positions:
+            for u_pos in slots:
                 if u_pos not in ["CI", "MI", "Util"]:
-                    if (df_pos["pos"].str.contains(u_pos)).any():
+                    if ((elig[players] & position_mask(u_pos)) != 0).any():
                         repl[u_pos] = repl["Util"]
 
+    return assigned, repl
+
+
+def assign_slots(totals, elig, slots, order=None, solver=SLOT_GREEDY, cache=None):
+
+    if solver == SLOT_OPTIMAL:
+        return allocate_optimal(totals, elig, slots, order, cache)
+    elif solver == SLOT_GREEDY:
+        return allocate_slots(totals, elig, slots, order)
+    else:
+        raise ValueError("Unknown slot solver: " + str(solver))
+
+
+def allocate_optimal(totals, elig, slots, order=None, cache=None):
+
+    # Filling roster slots is a transversal matroid: every player is worth
+    # the same in any slot he can fill, so taking players best first and
+    # keeping each one that still fits, shuffling others between slots to
+    # make room, gives the roster with the highest total. That's what a
+    # min-cost flow over players and slots would find, without building
+    # the graph. Who fills which slot only depends on a fixed order of
+    # positions, never on the order they're listed in.
+    if order is None:
+        order = sort_order(totals)
+
+    positions = sorted(slots, key=slot_priority)
+    masks = [position_mask(position) for position in positions]
+
+    # Each player's slots as bits, in the order of positions
+    fits = np.zeros(len(totals), dtype=np.int64)
+    for t, mask in enumerate(masks):
+        fits |= np.where((elig & mask) != 0, 1 << t, 0)
+
+    # The players taken only depend on who comes first and where they fit,
+    # so a pass that starts the same way as the last one can reuse it
+    capacity = [slots[position] for position in positions]
+    members = None
+    if cache is not None and "order" in cache and cache["slots"] == (positions, capacity):
+        scanned = len(cache["order"])
+        if np.array_equal(order[:scanned], cache["order"]) and np.array_equal(fits[cache["order"]], cache["fits"]):
+            members = cache["members"]
+
+    if members is None:
+        members, scanned = fill_slots(order, fits, capacity)
+        if cache is not None:
+            cache["slots"] = (positions, capacity)
+            cache["order"] = order[:scanned].copy()
+            cache["fits"] = fits[order[:scanned]]
+            cache["members"] = members
+
+    index = {position: i for i, position in enumerate(slots)}
+    assigned = np.full(len(totals), -1)
+    repl = {}
+    for t, position in enumerate(positions):
+        players = np.array(members[t], dtype=np.int64)
+        assigned[players] = index[position]
+        repl[position] = totals[players].min() if len(players) else np.nan
+
+    # Flexible slots set the level for the positions that fill them, when
+    # they go deeper
+    for position in positions:
+        if position in ["MI", "CI"]:
+            for f_pos in ["2B", "SS"] if position == "MI" else ["1B", "3B"]:
+                repl[f_pos] = np.fmin(repl.get(f_pos, np.nan), repl[position])
+        elif position == "Util":
+            players = assigned == index["Util"]
+            for u_pos in positions:
+                if u_pos not in FLEX_POSITIONS and ((elig[players] & position_mask(u_pos)) != 0).any():
+                    repl[u_pos] = np.fmin(repl[u_pos], repl["Util"])
+
+    return assigned, repl
+
+
+def slot_priority(position):
+
+    if position in FLEX_POSITIONS:
+        return (1 + FLEX_POSITIONS.index(position), 0)
+
+    return (0, position_mask(position))
+
+
+def fill_slots(order, fits, capacity):
+
+    # First pick the roster: take players best first, keeping each one the
+    # slots can still hold. Once someone doesn't fit, nobody who fits in
+    # the same slots or fewer can fit later either.
+    count = len(capacity)
+    subsets = np.arange(1 << count)
+    room = np.zeros(1 << count, dtype=np.int64)
+    for t, slots in enumerate(capacity):
+        room += slots * (subsets >> t & 1)
+
+    players = np.zeros(1 << count, dtype=np.int64)
+    dead = np.zeros(1 << count, dtype=bool)
+    dead[0] = True
+    ranked = fits[order]
+
+    roster = []
+    scanned = 0
+    while len(roster) < sum(capacity):
+        hits = np.flatnonzero(~dead[ranked[scanned:]])
+        if not len(hits):
+            scanned = len(order)
+            break
+        scanned += hits[0] + 1
+        bits = ranked[scanned - 1]
+        players[bits] += 1
+        if slots_hold(players, room, count):
+            roster.append(order[scanned - 1])
+        else:
+            players[bits] -= 1
+            dead[(subsets & ~bits) == 0] = True
+
+    # Then fill one position at a time, in priority order, with the best
+    # players on the roster who leave room for everyone else
+    members = []
+    for t in range(count):
+        room -= capacity[t] * (subsets >> t & 1)
+        taken = []
+        rest = []
+        for player in roster:
+            bits = fits[player]
+            if len(taken) < capacity[t] and bits >> t & 1:
+                players[bits] -= 1
+                if slots_hold(players, room + (capacity[t] - len(taken) - 1) * (subsets >> t & 1), count):
+                    taken.append(player)
+                    continue
+                players[bits] += 1
+            rest.append(player)
+        members.append(taken)
+        roster = rest
+
+    return members, scanned
+
+
+def slots_hold(players, room, count):
+
+    # Hall's condition: every group of slots has room for all the players
+    # who can't go anywhere else. players counts players by the slots they
+    # fit, so summing it over subsets gives how many need each group.
+    need = players.copy()
+    for t in range(count):
+        need = need.reshape(-1, 2, 1 << t)
+        need[:, 1, :] += need[:, 0, :]
+    need = need.reshape(-1)
+
+    return (need <= room).all()
+
+
+def adjusted_totals(totals, elig, repl):
+
+    adj_total = np.full(len(totals), -100.0)
+
     # For each position, adjust each player's total value by the
     # replacement level. Start with the smallest adjustment and get deeper.
     for position in sorted(repl, key=repl.get, reverse=True):
 
         if position in ["Util", "P"]:
-            df["adj_total"] = df["total"] - repl[position]
+            adj_total = totals - repl[position]
 
         if position not in ["CI", "MI", "Util", "P"]:
-            df.loc[df["pos"].str.contains(position), "adj_total"] = (
-                df["total"] - repl[position]
-            )
+            adj_total = np.where((elig & position_mask(position)) != 0, totals - repl[position], adj_total)
 
-    df["pos"] = df["actual_pos"]
-    return df, repl
+    return adj_total
 
-def scale_catchers(df, catcher_scale):
 
-    df.loc[df["pos"].str.contains("C"), "adj_total"] = df["adj_total"] * catcher_scale
+def allocation_elig(elig, positions):
 
-    return df
+    # For this process, we'll count P as SP if this league doesn't use P
+    if "SP" in positions and "P" not in positions:
+        no_role = (elig & (POSITION_BITS["SP"] | POSITION_BITS["RP"])) == 0
+        elig = np.where(no_role, elig | POSITION_BITS["SP"], elig)
 
+    return elig
 
-def calc_dollar_values(df, lg, is_batting):
+
+def calc_dollar_values(df, lg, is_batting, total_points=None):
     total_money = lg.teams * lg.budget
 
     if is_batting:
@@ -638,7 +3128,8 @@ def calc_dollar_values(df, lg, is_batting):
     # Save $1 for a minimum bid
     money = money - (lg.teams * sum(pos.values()))
 
-    total_points = df.head(num_players)["adj_total"].sum()
+    if total_points is None:
+        total_points = df.head(num_players)["adj_total"].sum()
 
     df["$"] = (df["adj_total"] / total_points) * money + 1
     dollar_rate = 1 / total_points * money
@@ -654,11 +3145,12 @@ def cleanup_cols(df, cats, m_cats, is_batting):
         appearances = "PA"
     else:
         appearances = "IP"
+        df["IP"] = outs_to_ip(df["OUTS"].to_numpy())
 
     if appearances in cats:
-        return df[["mlbam_id", "name", "pos"] + cats + m_cats + ["total", "adj_total"]]
+        return df[["mlbam_id", "name", "pos", "elig"] + cats + m_cats + ["total", "adj_total"]]
     else:
-        return df[["mlbam_id", "name", "pos", appearances] + cats + m_cats + ["total", "adj_total"]]
+        return df[["mlbam_id", "name", "pos", "elig", appearances] + cats + m_cats + ["total", "adj_total"]]
 
 
 def calculate_rate_stats(df, cats):
@@ -678,22 +3170,22 @@ def calculate_rate_stats(df, cats):
         df["OPS"] = ((df["H"] + df["BB"] + df["HBP"]) / (df["AB"] + df["BB"] + df["HBP"] + df["SF"])) + (df["TB"] / df["AB"])
 
     if "ERA" in cats:
-        df["ERA"] = df["ER"] / df["IP"] * 9
+        df["ERA"] = df["ER"] / df["OUTS"] * 27
     
     if "WHIP" in cats:
-        df["WHIP"] = (df["H"] + df["BB"]) / df["IP"]
+        df["WHIP"] = (df["H"] + df["BB"]) / df["OUTS"] * 3
 
     if "K/9" in cats:
-        df["K/9"] = df["SO"] / df["IP"] * 9
+        df["K/9"] = df["SO"] / df["OUTS"] * 27
 
     if "BB/9" in cats:
-        df["BB/9"] = df["BB"] / df["IP"] * 9
+        df["BB/9"] = df["BB"] / df["OUTS"] * 27
 
     if "K/BB" in cats:
         df["K/BB"] = df["SO"] / df["BB"]
 
     if "HR/9" in cats:
-        df["HR/9"] = df["HR"] / df["IP"] * 9
+        df["HR/9"] = df["HR"] / df["OUTS"] * 27
 
     return df
 
@@ -732,7 +3224,7 @@ def format_final_columns(df, lg):
         if "IP" not in lg.pitching_points:
             df = round_column(df, "IP", "IP")
 
-    df["mlbam_id"].fillna(0, inplace=True)
+    df["mlbam_id"] = df["mlbam_id"].fillna(0)
     df["mlbam_id"] = df["mlbam_id"].astype(int)
     df["total"] = df["total"].round(1)
     df["adj_total"] = df["adj_total"].round(1)
@@ -799,6 +3291,22 @@ def get_col_name(df, cat, is_batting):
         return None
 
 
+def data_years(system=""):
+
+    # A season needs its stats and the games by position from the year
+    # before it
+    root = Path(__file__).parent
+    years = []
+    for path in sorted((root / "data").glob("*" + system + "Batting.csv")):
+        year = path.name[:4]
+        if not year.isdigit() or path.name != year + system + "Batting.csv":
+            continue
+        if (root / "data" / (year + system + "Pitching.csv")).is_file() and (root / "games_by_pos" / (str(int(year) - 1) + ".csv")).is_file():
+            years.append(int(year))
+
+    return years
+
+
 def load_stats(system, year, lg, is_batting):
 
     if is_batting:
@@ -806,79 +3314,431 @@ def load_stats(system, year, lg, is_batting):
     else:
         filepath = Path(__file__).parent / "data" / (str(year) + system + "Pitching.csv")
 
-    df = pd.read_csv(filepath)
+    df = read_stats(filepath)
+
+    return df
+
+def read_stats(csv_path):
+
+    # Prefer the binary copy of the CSV as long as it was made from exactly
+    # this file, and make one if it wasn't
+    csv_path = Path(csv_path)
+
+    df = read_stats_cache(csv_path)
+    if df is None:
+        df = pd.read_csv(csv_path)
+        write_stats_cache(csv_path, df)
+
+    return apply_schema(df)
+
+
+def apply_schema(df):
+
+    # Innings are swapped for outs, in the same place IP was
+    if "IP" in df and "OUTS" not in df:
+        df = df.rename(columns={"IP": "OUTS"})
+        df["OUTS"] = pitching_outs(df["OUTS"])
+
+    # Only columns that really are whole numbers in range get the smaller
+    # type, so projections with fractional stats keep their floats
+    for col, dtype in STAT_SCHEMA.items():
+        if col not in df or df[col].dtype == dtype:
+            continue
+        values = df[col].to_numpy()
+        if values.dtype.kind not in "iuf" or not len(values):
+            continue
+        limits = np.iinfo(dtype)
+        if np.isfinite(values).all() and (values == np.round(values)).all() and values.min() >= limits.min and values.max() <= limits.max:
+            df[col] = values.astype(dtype)
 
     return df
 
+
+def cache_stats(csv_path):
+    write_stats_cache(Path(csv_path), pd.read_csv(csv_path))
+
+
+def stats_hash(csv_path):
+    return hashlib.sha1(csv_path.read_bytes()).hexdigest()
+
+
+def stats_stamp(csv_path):
+
+    stat = csv_path.stat()
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def stats_cache_path(csv_path):
+
+    if pa is not None:
+        return csv_path.with_suffix(".parquet")
+    else:
+        return csv_path.with_suffix(".npz")
+
+
+def write_stats_cache(csv_path, df):
+
+    meta = {"hash": stats_hash(csv_path), "stamp": stats_stamp(csv_path), "columns": list(df.columns), "outs": False, "missing": []}
+    cols = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if values.dtype.kind in "iu" and len(values) and np.abs(values).max() < 2**31:
+            values = values.astype(np.int32)
+        elif values.dtype.kind == "O":
+            # Missing text, like a player without a name, is kept as a
+            # mask next to the column
+            missing = df[col].isna().to_numpy()
+            if missing.any():
+                meta["missing"].append(col)
+                cols["missing:" + col] = missing
+                values = np.where(missing, "", values)
+            values = values.astype(str)
+        cols[col] = values
+
+    # IP comes in baseball notation (6.2 is 6 2/3 innings), which keeps
+    # exactly as a count of outs
+    if "IP" in cols and cols["IP"].dtype.kind == "f":
+        outs = ip_to_outs(cols["IP"])
+        if outs is not None:
+            del cols["IP"]
+            cols["OUTS"] = outs
+            meta["outs"] = True
+
+    write_stats_table(stats_cache_path(csv_path), cols, meta)
+
+
+def write_stats_table(cache_path, cols, meta):
+
+    tmp_path = cache_path.with_name(cache_path.name + "." + str(os.getpid()) + ".tmp")
+    if pa is not None:
+        table = pa.Table.from_pydict(cols)
+        table = table.replace_schema_metadata({"priceguide": json.dumps(meta)})
+        pq.write_table(table, tmp_path)
+    else:
+        # One record array rather than an array per column, so loading
+        # only has one header to read
+        table = np.empty(len(next(iter(cols.values()), [])), dtype=[(col, values.dtype) for col, values in cols.items()])
+        for col, values in cols.items():
+            table[col] = values
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), table=table)
+    os.replace(tmp_path, cache_path)
+
+
+def read_stats_cache(csv_path):
+
+    cache_path = stats_cache_path(csv_path)
+    if not cache_path.is_file():
+        return None
+
+    if pa is not None:
+        table = pq.read_table(cache_path)
+        meta = json.loads(table.schema.metadata[b"priceguide"])
+        cols = {name: table.column(name).to_numpy() for name in table.column_names}
+    else:
+        with np.load(cache_path) as npz:
+            meta = json.loads(str(npz["meta"]))
+            table = npz["table"]
+        cols = {name: table[name] for name in table.dtype.names}
+
+    # The CSV is only hashed when its size or modification time have
+    # changed. If it still hashes the same, the cache is stamped again so
+    # the next read doesn't hash it.
+    stamp = stats_stamp(csv_path)
+    if meta.get("stamp") != stamp:
+        if meta["hash"] != stats_hash(csv_path):
+            return None
+        meta["stamp"] = stamp
+        write_stats_table(cache_path, cols, meta)
+
+    for col in meta.get("missing", []):
+        cols[col] = np.where(cols.pop("missing:" + col), np.nan, cols[col].astype(object))
+
+    columns = ["OUTS" if col == "IP" and meta["outs"] else col for col in meta["columns"]]
+
+    return pd.DataFrame({col: cols[col] for col in columns})
+
+
+def ip_to_outs(ip):
+
+    if np.isnan(ip).any():
+        return None
+
+    whole = np.floor(ip).astype(np.int64)
+    partial = np.rint((ip - whole) * 10).astype(np.int64)
+    outs = whole * 3 + partial
+
+    # Only when every value really is in thirds, and reads back the same
+    if (partial > 2).any() or not np.array_equal(outs_to_ip(outs), ip) or outs.max(initial=0) >= 2**31:
+        return None
+
+    return outs.astype(np.int32)
+
+
+def outs_to_ip(outs):
+
+    # 6.2 as 62 / 10, which rounds to the same float as parsing "6.2".
+    # Partial outs from projections round to the nearest out.
+    outs = np.rint(np.asarray(outs, dtype=np.float64))
+
+    return (outs // 3 * 10 + outs % 3) / 10
+
+
+def pitching_outs(ip, decimal=False):
+
+    ip = pd.to_numeric(ip).to_numpy(dtype=np.float64)
+    if decimal:
+        return ip * 3
+    known = ~np.isnan(ip)
+
+    outs = ip_to_outs(ip[known])
+    if outs is None:
+        # Not baseball notation, so these are plain decimal innings
+        return ip * 3
+    if known.all():
+        return outs
+
+    result = np.full(len(ip), np.nan)
+    result[known] = outs
+    return result
+
 def load_extra(df):
 
     if "name" not in df.columns:
         if "name_last" in df.columns and "name_first" in df.columns:
-            df["name"] = df["name_first"] + " " + df["name_last"]
+            df = df.assign(name=df["name_first"] + " " + df["name_last"])
         else:
             df = load_names(df)
 
     return df
 
 def load_names(df):
-    filepath = Path(__file__).parent.parent
-    register = pd.DataFrame()
-    register = pd.read_csv(
-        filepath / "SFBB Player ID Map - PLAYERIDMAP.csv",
-        usecols=["MLBID", "MLBNAME"],
-    )
 
+    ids, offsets, names = player_id_map()
+    decoded = np.full(len(df), np.nan, dtype=object)
+
+    if len(ids):
+        mlbam_ids = pd.to_numeric(df["mlbam_id"], errors="coerce").fillna(-1).astype(np.int64).to_numpy()
+        found = np.minimum(np.searchsorted(ids, mlbam_ids), len(ids) - 1)
+        starts = offsets[found]
+        lengths = offsets[found + 1] - starts
+
+        # Players without a name in the map have an empty one
+        matched = (ids[found] == mlbam_ids) & (lengths > 0)
+
+        # Every name is gathered into one fixed-width byte string, so they
+        # all get decoded in one go
+        if matched.any():
+            starts = starts[matched]
+            lengths = lengths[matched]
+            width = np.arange(lengths.max())
+            gathered = names[np.minimum(starts[:, None] + width, len(names) - 1)]
+            gathered = np.where(width < lengths[:, None], gathered, 0).astype(np.uint8)
+            decoded[matched] = np.char.decode(gathered.view("S" + str(len(width))).ravel(), "utf-8")
+
+    return df.assign(name=decoded)
+
+
+_id_map = None
+
+
+def player_id_map():
+    global _id_map
+
+    # The compiled map is named after the CSV's modification time, so an
+    # updated CSV gets compiled again
+    mtime = ID_MAP_CSV.stat().st_mtime_ns
+    if _id_map is not None and _id_map[0] == mtime:
+        return _id_map[1]
+
+    prefix = CACHE_DIR / ("playeridmap-" + str(mtime))
+    paths = [Path(str(prefix) + part + ".npy") for part in (".ids", ".offsets", ".names")]
+    if not all(path.is_file() for path in paths):
+        compile_player_id_map(paths)
+
+    # Memory mapped, so every process reading the map shares the same pages
+    _id_map = (mtime, tuple(np.load(path, mmap_mode="r") for path in paths))
+
+    return _id_map[1]
+
+
+def compile_player_id_map(paths):
+
+    register = pd.read_csv(ID_MAP_CSV, usecols=["MLBID", "MLBNAME"])
+    register = register.dropna(subset=["MLBID"])
     register.drop_duplicates(["MLBID"], inplace=True)
+    register = register.sort_values("MLBID", kind="stable")
 
-    df = df.merge(register, how="left", left_on="mlbam_id", right_on="MLBID")
+    encoded = [str(name).encode() if isinstance(name, str) else b"" for name in register["MLBNAME"]]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(name) for name in encoded])
 
-    df.rename(columns={"MLBNAME": "name"}, inplace=True)
-    df.drop(["MLBID"], axis="columns", inplace=True)
+    arrays = [
+        register["MLBID"].to_numpy(dtype=np.int64),
+        offsets,
+        np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    ]
 
-    return df
+    CACHE_DIR.mkdir(exist_ok=True)
+    for old in CACHE_DIR.glob("playeridmap-*.npy"):
+        if old not in paths:
+            old.unlink()
 
-def load_games_by_pos(df, lg, year, is_batting):
-    
-    if "pos" not in df:
-        df["pos"] = ""
+    # Written under a temporary name first so another process never
+    # picks up half a file
+    for path, array in zip(paths, arrays):
+        tmp_path = path.with_name(path.name + "." + str(os.getpid()) + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+
+_gbp_years = OrderedDict()
+_gbp_files = OrderedDict()
+_gbp_eligibility = OrderedDict()
+
+
+def read_games_by_pos(year):
 
-    gbp = pd.read_csv(Path(__file__).parent / "games_by_pos" / (str(year - 1) + ".csv"), index_col="mlbam_id")
+    gbp = games_by_pos_file(year - 1).set_index("mlbam_id")
     gbp = gbp.add_prefix("G_")
 
     cur_year_csv = Path(__file__).parent / "games_by_pos" / (str(year) + ".csv")
     if cur_year_csv.is_file():
-        current_gbp = pd.read_csv(cur_year_csv, index_col="mlbam_id")
+        current_gbp = games_by_pos_file(year).set_index("mlbam_id")
         current_gbp = current_gbp.add_prefix("GC_")
         gbp = gbp.join(current_gbp, how="outer")
         gbp = gbp.fillna(0)
 
-    gbp["gbp_pos"] = ""
+    return gbp.astype(np.int32).sort_index()
+
+
+def games_by_pos_file(year):
+
+    # Each file is part of two years' tables, its own and the next one's,
+    # so a run through consecutive years only reads it once
+    if year in _gbp_files:
+        _gbp_files.move_to_end(year)
+    else:
+        _gbp_files[year] = read_stats(Path(__file__).parent / "games_by_pos" / (str(year) + ".csv"))
+        while len(_gbp_files) > GBP_CACHE_YEARS + 1:
+            _gbp_files.popitem(last=False)
+
+    return _gbp_files[year]
+
+
+def games_by_pos(year):
+
+    if year in _gbp_years:
+        _gbp_years.move_to_end(year)
+    else:
+        store_games_by_pos(year, read_games_by_pos(year))
+
+    return _gbp_years[year]
+
+
+def store_games_by_pos(year, gbp):
+
+    _gbp_years[year] = gbp
+    while len(_gbp_years) > GBP_CACHE_YEARS:
+        _gbp_years.popitem(last=False)
+
+
+def invalidate_games_by_pos(year=None):
+
+    # Each year's table also reads the year before, so a rewritten file
+    # affects that year and the next
+    if year is None:
+        years = list(_gbp_years)
+    else:
+        years = [year, year + 1]
+
+    for gbp_year in years:
+        _gbp_years.pop(gbp_year, None)
+    if year is None:
+        _gbp_files.clear()
+    else:
+        _gbp_files.pop(year, None)
+
+    for key in [key for key in _gbp_eligibility if key[0] in years]:
+        del _gbp_eligibility[key]
+
+
+def gbp_eligibility(year, min_games):
+
+    key = (year, tuple(min_games.items()))
+    if key in _gbp_eligibility:
+        _gbp_eligibility.move_to_end(key)
+        return _gbp_eligibility[key]
+
+    gbp = games_by_pos(year)
+    gbp_elig = pd.Series(0, index=gbp.index, dtype=np.int64)
+    for position, games in min_games.items():
+        if "G_" + position in gbp.columns:
+            eligible = gbp["G_" + position] >= games
+            if "GC_" + position in gbp.columns:
+                eligible |= gbp["GC_" + position] >= games
+            gbp_elig |= np.where(eligible, POSITION_BITS[position], 0)
+
+    _gbp_eligibility[key] = gbp_elig
+    while len(_gbp_eligibility) > GBP_CACHE_ELIGIBILITY:
+        _gbp_eligibility.popitem(last=False)
+
+    return gbp_elig
+
+
+def load_games_by_pos(df, lg, year, is_batting):
+
+    df = df.reset_index(drop=True)
+    if "pos" not in df:
+        df["pos"] = ""
 
     if is_batting:
-        for hit_pos in lg.hitting_positions:
-            if "G_" + hit_pos in gbp.columns and "GC_" + hit_pos in gbp.columns:
-                gbp.loc[(gbp["G_" + hit_pos] >= lg.hitting_eligibility) | (gbp["GC_" + hit_pos] >= lg.hitting_eligibility), "gbp_pos"] += hit_pos + "-"
-            elif "G_" + hit_pos in gbp.columns:
-                gbp.loc[gbp["G_" + hit_pos] >= lg.hitting_eligibility, "gbp_pos"] += hit_pos + "-"
-    else:
-        if "G_SP" in gbp.columns and "GC_SP" in gbp.columns:
-            gbp.loc[(gbp["G_SP"] >= lg.sp_eligibility) | (gbp["GC_SP"] >= lg.sp_eligibility), "gbp_pos"] += "SP-"
-        elif "G_SP" in gbp.columns:
-            gbp.loc[gbp["G_SP"] >= lg.sp_eligibility, "gbp_pos"] += "SP-"
-        if "G_RP" in gbp.columns and "GC_RP" in gbp.columns:
-            gbp.loc[(gbp["G_RP"] >= lg.rp_eligibility) | (gbp["GC_RP"] >= lg.rp_eligibility), "gbp_pos"] += "RP-"
-        elif "G_RP" in gbp.columns:
-            gbp.loc[gbp["G_RP"] >= lg.rp_eligibility, "gbp_pos"] += "RP-"
-    gbp["gbp_pos"] = gbp["gbp_pos"].str.rstrip("-")
-
-    df = df.merge(gbp, how="left", on="mlbam_id")
-    df["gbp_pos"] = df["gbp_pos"].fillna("")
+        min_games = {hit_pos: lg.hitting_eligibility for hit_pos in lg.hitting_positions}
+    else:
+        min_games = {"SP": lg.sp_eligibility, "RP": lg.rp_eligibility}
+
     df["pos"] = df["pos"].fillna("")
 
-    df.loc[df["gbp_pos"] != "", "pos"] = df["gbp_pos"]
+    # Games played decide eligibility when we have them, otherwise we go by
+    # whatever positions came in with the stats
+    gbp_elig = gbp_eligibility(year, min_games).reindex(df["mlbam_id"]).fillna(0).astype(np.int64).to_numpy()
+    df["elig"] = np.where(gbp_elig != 0, gbp_elig, elig_from_pos(df["pos"]))
+    if is_batting:
+        df["elig"] |= POSITION_BITS["Util"]
+    else:
+        df["elig"] |= POSITION_BITS["P"]
 
     return df
 
 
+def elig_from_pos(pos):
+
+    tokens = pos.reset_index(drop=True).str.split(r"[-/,]").explode()
+    bits = tokens.map(lambda token: POSITION_BITS.get(token, 0) | POSITION_BITS.get(POSITION_ALIASES.get(token), 0))
+
+    elig = np.zeros(len(pos), dtype=np.int64)
+    np.bitwise_or.at(elig, tokens.index.to_numpy(), bits.to_numpy(dtype=np.int64))
+
+    return elig
+
+
+def render_positions(df, positions, is_batting):
+
+    if is_batting:
+        names = [position for position in positions if position in POSITION_BITS and position != "Util"]
+    else:
+        names = ["SP", "RP"]
+
+    pos = pd.Series("", index=df.index)
+    for name in names:
+        pos += np.where(df["elig"] & POSITION_BITS[name], name + "-", "")
+    pos = pos.str.rstrip("-")
+
+    # Players we only know by the positions they came in with keep them
+    return df.assign(pos=pos.where(pos != "", df["pos"])).drop(columns="elig")
+
+
 def save_values(system, year, df):
     df.to_csv(Path(__file__).parent / "output" / (str(year) + system + "Values.csv"), index=False)
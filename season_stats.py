@@ -1,105 +1,180 @@
+import json
+import os
+import threading
 import pandas as pd
 import numpy as np
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib.parse import parse_qs, urlparse
+from urllib3.util.retry import Retry
+
+try:
+    from . import priceguide
+except ImportError:
+    import priceguide
+
+STATS_URL = "http://statsapi.mlb.com/api/v1/stats"
+
+# Raw responses are kept here so an interrupted run can pick up where it left off
+RAW_DIR = Path(__file__).parent / "raw"
+
+# Where the season stats and games by position get written
+DATA_DIR = Path(__file__).parent / "data"
+GBP_DIR = Path(__file__).parent / "games_by_pos"
+
+# Our column name and the statsapi field for each stat
+BATTING_STATS = {
+    "AB": "atBats",
+    "R": "runs",
+    "H": "hits",
+    "2B": "doubles",
+    "3B": "triples",
+    "HR": "homeRuns",
+    "RBI": "rbi",
+    "SB": "stolenBases",
+    "CS": "caughtStealing",
+    "BB": "baseOnBalls",
+    "SO": "strikeOuts",
+    "HBP": "hitByPitch",
+    "SH": "sacBunts",
+    "SF": "sacFlies",
+}
+
+PITCHING_STATS = {
+    "GS": "gamesStarted",
+    "W": "wins",
+    "L": "losses",
+    "CG": "completeGames",
+    "SHO": "shutouts",
+    "SV": "saves",
+    "BS": "blownSaves",
+    "HLD": "holds",
+    "IP": "inningsPitched",
+    "H": "hits",
+    "R": "runs",
+    "ER": "earnedRuns",
+    "HR": "homeRuns",
+    "BB": "baseOnBalls",
+    "IBB": "intentionalWalks",
+    "SO": "strikeOuts",
+    "HBP": "hitBatsmen",
+    "BK": "balks",
+    "WP": "wildPitches",
+}
 
 def main():
     build_all(2022)
 
 def build_all(year):
 
-    build_batting(year)
-    build_pitching(year)
-    build_gbp(year)
-
-def build_batting(year):
-    url = "http://statsapi.mlb.com/api/v1/stats?stats=season&group=hitting&season={}&playerPool=ALL&limit=5000".format(year)
-    
-    records = requests.get(url).json()
-
-    players = []
-
-    for record in records["stats"]:
-        for split in record["splits"]:
-            player = {}
-            player["mlbam_id"] = split["player"]["id"]
-            player["AB"] = split["stat"]["atBats"]
-            player["R"] = split["stat"]["runs"]
-            player["H"] = split["stat"]["hits"]
-            player["2B"] = split["stat"]["doubles"]
-            player["3B"] = split["stat"]["triples"]
-            player["HR"] = split["stat"]["homeRuns"]
-            player["RBI"] = split["stat"]["rbi"]
-            player["SB"] = split["stat"]["stolenBases"]
-            player["CS"] = split["stat"]["caughtStealing"]
-            player["BB"] = split["stat"]["baseOnBalls"]
-            player["SO"] = split["stat"]["strikeOuts"]
-            player["HBP"] = split["stat"]["hitByPitch"]
-            player["SH"] = split["stat"]["sacBunts"]
-            player["SF"] = split["stat"]["sacFlies"]
-            players.append(player)
-
-
-    df = pd.DataFrame(players)
-
-    df.to_csv(Path(__file__).parent / "data" / (str(year) + "Batting.csv"), index=False)
-
-def build_pitching(year):
-    url = "http://statsapi.mlb.com/api/v1/stats?stats=season&group=pitching&season={}&playerPool=ALL&limit=5000".format(year)
-    
-    records = requests.get(url).json()
-
-    players = []
-
-    for record in records["stats"]:
-        for split in record["splits"]:
-            player = {}
-            player["mlbam_id"] = split["player"]["id"]
-            player["GS"] = split["stat"]["gamesStarted"]
-            player["W"] = split["stat"]["wins"]
-            player["L"] = split["stat"]["losses"]
-            player["CG"] = split["stat"]["completeGames"]
-            player["SHO"] = split["stat"]["shutouts"]
-            player["SV"] = split["stat"]["saves"]
-            player["BS"] = split["stat"]["blownSaves"]
-            player["HLD"] = split["stat"]["holds"]
-            player["IP"] = split["stat"]["inningsPitched"]
-            player["H"] = split["stat"]["hits"]
-            player["R"] = split["stat"]["runs"]
-            player["ER"] = split["stat"]["earnedRuns"]
-            player["HR"] = split["stat"]["homeRuns"]
-            player["BB"] = split["stat"]["baseOnBalls"]
-            player["IBB"] = split["stat"]["intentionalWalks"]
-            player["SO"] = split["stat"]["strikeOuts"]
-            player["HBP"] = split["stat"]["hitBatsmen"]
-            player["BK"] = split["stat"]["balks"]
-            player["WP"] = split["stat"]["wildPitches"]
-            players.append(player)
-
-
-    df = pd.DataFrame(players)
-
-    df.to_csv(Path(__file__).parent / "data" / (str(year) + "Pitching.csv"), index=False)
-
-
-def build_gbp(year):
-    url = "http://statsapi.mlb.com/api/v1/stats?stats=season&group=fielding&season={}&playerPool=ALL&limit=5000".format(year)
-    
-    records = requests.get(url).json()
-
-    players = []
-
-    for record in records["stats"]:
-        for split in record["splits"]:
-            player = {}
-            player["mlbam_id"] = split["player"]["id"]
-            player["pos"] = split["position"]["abbreviation"]
-            player["G"] = split["stat"]["games"]
-            player["GS"] = split["stat"]["gamesStarted"]
-            players.append(player)
-
-
-    df = pd.DataFrame(players)
+    # The current season keeps changing, so always fetch it fresh
+    build_range([year], resume=False)
+
+def build_range(years, concurrency=4, base_url=STATS_URL, raw_dir=RAW_DIR, resume=True):
+
+    session = stats_session(concurrency)
+    jobs = [(year, group) for year in years for group in ["hitting", "pitching", "fielding"]]
+
+    def fetch(job):
+        return fetch_stats(session, job[0], job[1], base_url, raw_dir, resume)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        paths = list(pool.map(fetch, jobs))
+
+    builders = {"hitting": build_batting, "pitching": build_pitching, "fielding": build_gbp}
+    for (year, group), path in zip(jobs, paths):
+        builders[group](year, path)
+
+def stats_session(pool_size=1):
+
+    # Retries with backoff when statsapi is busy or the connection drops
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+def raw_path(raw_dir, year, group):
+    return Path(raw_dir) / (str(year) + "-" + group + ".json")
+
+def fetch_stats(session, year, group, base_url=STATS_URL, raw_dir=RAW_DIR, resume=True):
+
+    path = raw_path(raw_dir, year, group)
+    if resume and path.is_file():
+        return path
+
+    params = {"stats": "season", "group": group, "season": year, "playerPool": "ALL", "limit": 5000}
+
+    # Streamed into a temporary file, so only complete responses ever
+    # show up under the real name. It's named for this process and thread,
+    # so two fetches of the same file never write into each other's.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp")
+    try:
+        with session.get(base_url, params=params, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    return path
+
+def read_splits(path):
+
+    with open(path) as f:
+        records = json.load(f)
+
+    return pd.json_normalize([split for record in records["stats"] for split in record["splits"]])
+
+def stats_columns(splits, stats):
+
+    df = splits[["player.id"] + ["stat." + field for field in stats.values()]]
+    df.columns = ["mlbam_id"] + list(stats)
+
+    return df
+
+def build_batting(year, path=None):
+
+    if path is None:
+        path = fetch_stats(stats_session(), year, "hitting", resume=False)
+
+    df = stats_columns(read_splits(path), BATTING_STATS)
+
+    filepath = DATA_DIR / (str(year) + "Batting.csv")
+    df.to_csv(filepath, index=False)
+    priceguide.cache_stats(filepath)
+
+def build_pitching(year, path=None):
+
+    if path is None:
+        path = fetch_stats(stats_session(), year, "pitching", resume=False)
+
+    # Innings are kept in baseball notation, like the rest of data/, and
+    # turned into outs when they're loaded
+    df = stats_columns(read_splits(path), PITCHING_STATS)
+
+    filepath = DATA_DIR / (str(year) + "Pitching.csv")
+    df.to_csv(filepath, index=False)
+    priceguide.cache_stats(filepath)
+
+
+def build_gbp(year, path=None):
+
+    if path is None:
+        path = fetch_stats(stats_session(), year, "fielding", resume=False)
+
+    splits = read_splits(path)
+    df = splits[["player.id", "position.abbreviation", "stat.games", "stat.gamesStarted"]]
+    df.columns = ["mlbam_id", "pos", "G", "GS"]
 
     pivot = df.pivot_table(index="mlbam_id", columns="pos", values=["GS", "G"], aggfunc=np.sum, fill_value=0)
 
@@ -110,7 +185,41 @@ def build_gbp(year):
     by_pos["RP"] = pivot["G"]["P"] - pivot["GS"]["P"]
     by_pos["SP"] = pivot["GS"]["P"]
     by_pos.drop("P", axis="columns", inplace=True)
-    by_pos.to_csv(Path(__file__).parent / "games_by_pos" / (str(year) + ".csv"))
+    filepath = GBP_DIR / (str(year) + ".csv")
+    by_pos.to_csv(filepath)
+    priceguide.cache_stats(filepath)
+    priceguide.invalidate_games_by_pos(year)
+
+
+def serve_recorded(raw_dir=RAW_DIR, port=0):
+
+    # A stand-in for statsapi that answers from recorded responses, so the
+    # fetcher can run offline. Point build_range at
+    # "http://127.0.0.1:<server.server_port>/api/v1/stats" and call
+    # server.shutdown() when done.
+    class RecordedHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            path = raw_path(raw_dir, query["season"][0], query["group"][0])
+            if not path.is_file():
+                self.send_error(404)
+                return
+
+            body = path.read_bytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), RecordedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
 
 
 if __name__ == "__main__":
@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+@pytest.fixture
+def season():
+
+    # The ID map isn't bundled, so the players get their ids as names
+    def load(year):
+        hitters = pd.read_csv(DATA_DIR / (str(year) + "Batting.csv"))
+        pitchers = pd.read_csv(DATA_DIR / (str(year) + "Pitching.csv"))
+        hitters["name"] = hitters["mlbam_id"].astype(str)
+        pitchers["name"] = pitchers["mlbam_id"].astype(str)
+        return hitters, pitchers
+
+    return load
@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+
+    # Every test starts with an empty cache, kept on disk under tmp_path
+    monkeypatch.setattr(priceguide, "RESULT_CACHE_DIR", tmp_path / "cache" / "results")
+    priceguide.clear_result_cache()
+    yield
+    priceguide.clear_result_cache()
+
+
+def cached(lg, hitters, pitchers, **kwargs):
+
+    return priceguide.calculate_cached(lg, 2022, hitters, pitchers, priceguide.ENGINE_NUMPY, **kwargs)
+
+
+def test_hit_from_memory(season, cache):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    first, config = cached(lg, hitters, pitchers)
+    first["$"] = 0
+
+    again, again_config = cached(lg, hitters.copy(), pitchers.copy())
+
+    info = priceguide.result_cache_info()
+    assert (info["hits"], info["misses"], info["entries"]) == (1, 1, 1)
+    expected, _ = priceguide.calculate(lg, 2022, hitters, pitchers, priceguide.ENGINE_NUMPY)
+    pd.testing.assert_frame_equal(again, expected)
+    assert again_config is config
+
+
+def test_misses_on_league_data_and_key(season, cache):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    cached(lg, hitters, pitchers)
+
+    other = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    other.budget = 300
+    cached(other, hitters, pitchers)
+
+    changed = hitters.copy()
+    changed.loc[0, "HR"] += 1
+    cached(lg, changed, pitchers)
+
+    cached(lg, hitters, pitchers, data_key="steamer-0401")
+    cached(lg, hitters, pitchers, data_key="steamer-0402")
+
+    # A data_key names the stats, so they aren't looked at
+    cached(lg, changed, pitchers, data_key="steamer-0402")
+
+    info = priceguide.result_cache_info()
+    assert (info["hits"], info["misses"], info["entries"]) == (1, 5, 5)
+
+
+def test_evicts_past_the_limit(season, cache, monkeypatch):
+
+    hitters, pitchers = season(2022)
+    cached(priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5), hitters, pitchers)
+    size = priceguide.result_cache_info()["bytes"]
+
+    # Room for one result and a bit, so each new one pushes the last out
+    monkeypatch.setattr(priceguide, "RESULT_CACHE_BYTES", size * 3 // 2)
+    cached(priceguide.League(priceguide.League.LEAGUE_STANDARD_4x4), hitters, pitchers)
+    cached(priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5), hitters, pitchers)
+
+    info = priceguide.result_cache_info()
+    assert (info["hits"], info["misses"], info["evictions"], info["entries"]) == (0, 3, 2, 1)
+    assert info["bytes"] <= priceguide.RESULT_CACHE_BYTES
+
+
+def test_disk_only_loads_trusted_files(season, cache):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    expected, _ = cached(lg, hitters, pitchers, disk=True)
+    path, = priceguide.RESULT_CACHE_DIR.glob("*.pkl.z")
+    assert not priceguide.RESULT_CACHE_DIR.stat().st_mode & 0o077
+
+    priceguide.clear_result_cache()
+    df, _ = cached(lg, hitters, pitchers, disk=True)
+    assert priceguide.result_cache_info()["disk_hits"] == 1
+    pd.testing.assert_frame_equal(df, expected)
+
+    # Anyone else who could have written the pickle could run code with it
+    path.chmod(0o664)
+    assert not priceguide.trusted_file(path)
+    priceguide.clear_result_cache()
+    cached(lg, hitters, pitchers, disk=True)
+    info = priceguide.result_cache_info()
+    assert (info["disk_hits"], info["misses"]) == (0, 1)
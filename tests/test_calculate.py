@@ -0,0 +1,45 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+def by_player(df):
+
+    # Two-way players have a row on each side, and players tied on $ can
+    # come out in either order
+    return df.sort_values(["mlbam_id", "pos", "$"]).reset_index(drop=True)
+
+
+def test_warm_start_leaves_no_copies(season):
+
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    _, start = priceguide.calculate(lg, 2021, *season(2021))
+    hitters, pitchers = season(2022)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.SettingWithCopyWarning)
+        df, config = priceguide.calculate(lg, 2022, hitters, pitchers, start=start)
+
+    expected, expected_config = priceguide.calculate(lg, 2022, hitters, pitchers, priceguide.ENGINE_NUMPY, start=start)
+    pd.testing.assert_frame_equal(by_player(df), by_player(expected))
+    assert config["hitting"]["convergence"] == expected_config["hitting"]["convergence"]
+
+
+@pytest.mark.parametrize("league", [
+    priceguide.League.LEAGUE_STANDARD_5x5,
+    priceguide.League.LEAGUE_STANDARD_4x4,
+    priceguide.League.LEAGUE_ESPN_ROTO,
+    priceguide.League.LEAGUE_OTTONEU_4x4,
+    priceguide.League.LEAGUE_CBS_POINTS,
+])
+def test_engines_match(season, league):
+
+    hitters, pitchers = season(2022)
+    expected, expected_config = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers, priceguide.ENGINE_PANDAS)
+    df, config = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers, priceguide.ENGINE_NUMPY)
+
+    pd.testing.assert_frame_equal(df, expected)
+    assert config == expected_config
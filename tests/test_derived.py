@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import priceguide
+
+
+@pytest.fixture(autouse=True)
+def derived(monkeypatch):
+
+    # Stats added here go away after each test
+    monkeypatch.setattr(priceguide, "DERIVED_STATS", dict(priceguide.DERIVED_STATS))
+    monkeypatch.setattr(priceguide, "DERIVED_SIDES", dict(priceguide.DERIVED_SIDES))
+    yield
+    priceguide._derived_plans.clear()
+
+
+def test_custom_stats_follow_what_they_read(season):
+
+    # XA is listed first but reads XC, which is only added after it, and
+    # K9 reads IP, which is worked out from outs
+    priceguide.derive_stat("XA", "SO", False)
+    priceguide.derive_stat("XB", "XA * 2", False)
+    priceguide.derive_stat("XC", "BB + HR", False)
+    priceguide.derive_stat("XA", "XC + SO", False)
+    priceguide.derive_stat("K9", "SO * 9 / IP", False)
+
+    _, pitchers = season(2022)
+    df = priceguide.project_stats(pitchers, False, ["XB", "K9"])
+    _, steps = priceguide.derived_plan(["XB", "K9"], False, df.columns)
+    order = [stat for stat, _, _ in steps]
+    assert order.index("XC") < order.index("XA") < order.index("XB")
+    assert order.index("IP") < order.index("K9")
+
+    df = priceguide.add_missing_cols(df, ["XB", "K9"], False)
+    np.testing.assert_array_equal(df["XB"], (pitchers["BB"] + pitchers["HR"] + pitchers["SO"]) * 2)
+    np.testing.assert_allclose(df["K9"], pitchers["SO"] * 27 / df["OUTS"])
+
+
+def test_custom_stat_in_a_league(season):
+
+    priceguide.derive_stat("KBB", "SO - BB", False)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    lg.pitching_categories = ["W", "SV", "KBB", "ERA", "WHIP"]
+
+    df, config = priceguide.calculate(lg, 2022, *season(2022))
+
+    assert config["pitching"]["cats"] == ["W", "SV", "KBB", "ERA", "WHIP"]
+    assert "mKBB" in df.columns
+
+
+def test_cycle_is_refused():
+
+    priceguide.derive_stat("XA", "SO", False)
+    priceguide.derive_stat("XB", "XA + 1", False)
+    priceguide.derive_stat("XA", "XB - 1", False)
+
+    with pytest.raises(ValueError, match="worked out from itself"):
+        priceguide.derived_plan(["XB"], False, ["SO", "BB"])
+
+
+@pytest.mark.parametrize("expression", ["1e3", "SO - XX", "abs(SO)", "__builtins__", "2B + 4B", "SO + K-BB"])
+def test_unknown_stats_are_refused(expression):
+
+    with pytest.raises(ValueError, match="unknown stats"):
+        priceguide.derive_stat("X", expression)
+    assert "X" not in priceguide.DERIVED_STATS
+
+
+@pytest.mark.parametrize("expression", ["__import__('os')", "SO.real", "SO ** 2", "[SO]", "SO if BB else HR", "SO;BB", "", "SO BB"])
+def test_unreadable_expressions_are_refused(expression):
+
+    with pytest.raises(ValueError, match="Can't read"):
+        priceguide.derive_stat("X", expression)
+    assert "X" not in priceguide.DERIVED_STATS
+
+
+def test_formula_only_reads_stats():
+
+    # Every name in an expression becomes a lookup in the stats it reads,
+    # so the compiled code can't reach anything else
+    code, deps = priceguide.stat_formula("H + 2B + abs * 2")
+    assert deps == ["H", "2B", "abs"]
+    assert code.co_names == ("s",)
+    assert eval(code, {"__builtins__": {}}, {"s": [1, 2, 3]}) == 9
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+# Sessions work on their own frames, never on slices of the caller's
+pytestmark = pytest.mark.filterwarnings("error::pandas.errors.SettingWithCopyWarning")
+
+LEAGUES = [priceguide.League.LEAGUE_STANDARD_5x5, priceguide.League.LEAGUE_OTTONEU_4x4, priceguide.League.LEAGUE_CBS_POINTS]
+
+
+def dollars(df):
+
+    # Two-way players have a row on each side
+    return df.sort_values(["mlbam_id", "pos"])[["mlbam_id", "pos", "$"]].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("league", LEAGUES)
+def test_session_matches_calculate(season, league):
+
+    hitters, pitchers = season(2022)
+    before = hitters.copy()
+    expected, _ = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers)
+
+    session = priceguide.draft_session(priceguide.League(league), 2022, hitters, pitchers)
+
+    pd.testing.assert_frame_equal(dollars(session["values"]), dollars(expected))
+    pd.testing.assert_frame_equal(hitters, before)
+    assert session["hitting"]["drift"] == pytest.approx(0, abs=1e-9)
+    assert session["pitching"]["drift"] == pytest.approx(0, abs=1e-9)
+
+
+@pytest.mark.parametrize("league", LEAGUES)
+def test_restore_gets_values_back(season, league):
+
+    session = priceguide.draft_session(priceguide.League(league), 2022, *season(2022))
+    original = dollars(session["values"])
+    top = session["values"]["mlbam_id"].head(20).tolist()
+
+    removed = priceguide.draft_remove(session, top)
+    assert not removed["mlbam_id"].isin(top).any()
+    assert len(removed) == len(original) - original["mlbam_id"].isin(top).sum()
+
+    restored = priceguide.draft_restore(session, top)
+    pd.testing.assert_frame_equal(dollars(restored), original)
+    pd.testing.assert_frame_equal(dollars(session["values"]), original)
+
+
+def test_settings_match_calculate(season):
+
+    hitters, pitchers = season(2022)
+    session = priceguide.draft_session(priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5), 2022, hitters, pitchers)
+    values = priceguide.draft_settings(session, catcher_scale=1.0, budget=300, hitting_split=0.65)
+
+    # None of these change the averages or sds, so valuing again agrees
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    lg.catcher_scale = 1.0
+    lg.budget = 300
+    lg.hitting_split = 0.65
+    expected, _ = priceguide.calculate(lg, 2022, hitters, pitchers)
+    pd.testing.assert_frame_equal(dollars(values), dollars(expected))
+
+    with pytest.raises(ValueError):
+        priceguide.draft_settings(session, num_teams=10)
+
+
+def test_refresh_matches_calculate(season):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    session = priceguide.draft_session(lg, 2022, hitters, pitchers)
+    top = session["values"]["mlbam_id"].head(20).tolist()
+    priceguide.draft_remove(session, top)
+    assert session["hitting"]["drift"] > 0
+
+    values = priceguide.draft_refresh(session)
+    expected, _ = priceguide.calculate(lg, 2022, hitters[~hitters["mlbam_id"].isin(top)], pitchers[~pitchers["mlbam_id"].isin(top)])
+    np.testing.assert_array_equal(np.sort(values["$"].to_numpy()), np.sort(expected["$"].to_numpy()))
+    assert session["hitting"]["drift"] == pytest.approx(0, abs=1e-9)
+    assert session["pitching"]["drift"] == pytest.approx(0, abs=1e-9)
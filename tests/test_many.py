@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+LEAGUES = [priceguide.League.LEAGUE_STANDARD_5x5, priceguide.League.LEAGUE_YAHOO, priceguide.League.LEAGUE_ESPN_POINTS]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_many_matches_calculate(season, workers):
+
+    hitters, pitchers = season(2022)
+    before = hitters.copy(), pitchers.copy()
+
+    results = priceguide.calculate_many(LEAGUES, 2022, hitters, pitchers, workers=workers)
+
+    assert list(results) == LEAGUES
+    for league in LEAGUES:
+        expected, expected_config = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers)
+        df, config = results[league]
+        pd.testing.assert_frame_equal(df, expected)
+        assert config == expected_config
+
+    pd.testing.assert_frame_equal(hitters, before[0])
+    pd.testing.assert_frame_equal(pitchers, before[1])
+
+
+POINTS_LEAGUES = [
+    priceguide.League.LEAGUE_CBS_POINTS,
+    priceguide.League.LEAGUE_ESPN_POINTS,
+    priceguide.League.LEAGUE_OTTONEU_FG_POINTS,
+    priceguide.League.LEAGUE_OTTONEU_SABR_POINTS,
+]
+
+
+def test_batched_points_match_calculate(season, monkeypatch):
+
+    hitters, pitchers = season(2022)
+
+    # Every points league's totals come from the one batched pass
+    batches = []
+    batch_points_totals = priceguide.batch_points_totals
+    monkeypatch.setattr(priceguide, "batch_points_totals", lambda *args: batches.append(batch_points_totals(*args)) or batches[-1])
+    results = priceguide.calculate_many(POINTS_LEAGUES + [priceguide.League.LEAGUE_STANDARD_5x5], 2022, hitters, pitchers, engine=priceguide.ENGINE_NUMPY)
+
+    assert len(batches) == 1
+    assert sorted(batches[0]) == sorted(POINTS_LEAGUES)
+    for league in POINTS_LEAGUES:
+        expected, expected_config = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers, priceguide.ENGINE_NUMPY)
+        df, config = results[league]
+        pd.testing.assert_frame_equal(df, expected)
+        assert config == expected_config
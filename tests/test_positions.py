@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+BITS = priceguide.POSITION_BITS
+
+
+def elig(pos):
+
+    return int(priceguide.elig_from_pos(pd.Series([pos]))[0])
+
+
+@pytest.mark.parametrize("pos, expected", [
+    ("C", BITS["C"]),
+    ("CF", BITS["CF"] | BITS["OF"]),
+    ("LF/RF", BITS["LF"] | BITS["RF"] | BITS["OF"]),
+    ("DH", BITS["DH"] | BITS["Util"]),
+    ("SP/RP", BITS["SP"] | BITS["RP"]),
+    ("P", BITS["P"]),
+    ("1B-3B,SS", BITS["1B"] | BITS["3B"] | BITS["SS"]),
+    ("", 0),
+])
+def test_elig_from_pos(pos, expected):
+
+    assert elig(pos) == expected
+
+
+def test_positions_dont_match_by_name():
+
+    # C isn't part of CF, and P isn't part of SP
+    assert not elig("CF") & priceguide.position_mask("C")
+    assert not elig("C") & priceguide.position_mask("CF")
+    assert not elig("SP") & priceguide.position_mask("P")
+    assert not elig("RP") & priceguide.position_mask("P")
+
+
+@pytest.mark.parametrize("pos, mi, ci", [
+    ("2B", True, False),
+    ("SS", True, False),
+    ("1B", False, True),
+    ("3B", False, True),
+    ("2B/3B", True, True),
+    ("C", False, False),
+    ("OF", False, False),
+])
+def test_flex_masks(pos, mi, ci):
+
+    assert bool(elig(pos) & priceguide.position_mask("MI")) == mi
+    assert bool(elig(pos) & priceguide.position_mask("CI")) == ci
+
+
+def test_elig_keeps_row_order():
+
+    pos = pd.Series(["SS", "C", "SP"], index=[7, 3, 5])
+    np.testing.assert_array_equal(priceguide.elig_from_pos(pos), [BITS["SS"], BITS["C"], BITS["SP"]])
@@ -0,0 +1,45 @@
+import json
+
+import pandas as pd
+
+import priceguide
+
+
+def test_config_survives_json(season):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    _, config = priceguide.calculate(lg, 2022, hitters, pitchers, engine=priceguide.ENGINE_NUMPY)
+    saved = json.loads(json.dumps(config))
+
+    for is_batting, df in [(True, hitters.assign(pos="1B")), (False, pitchers.assign(pos="P", G=pitchers["GS"] + 5))]:
+        expected = priceguide.quick_calc(config, df, is_batting)
+        pd.testing.assert_frame_equal(priceguide.quick_calc(saved, df, is_batting), expected)
+
+
+def test_recalculate_replays_saved_config(season, monkeypatch):
+
+    hitters, pitchers = season(2022)
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    _, config = priceguide.calculate(lg, 2022, hitters, pitchers, engine=priceguide.ENGINE_NUMPY)
+    saved = json.loads(json.dumps(config))
+
+    # A few fringe hitters get one more at bat
+    changed = hitters[hitters["AB"] < 20].head(5).copy()
+    changed["AB"] += 1
+    expected, expected_config = priceguide.calculate(lg, 2022, priceguide.apply_changes(hitters, changed), pitchers, engine=priceguide.ENGINE_NUMPY)
+
+    replayed = []
+    can_replay = priceguide.can_replay
+    monkeypatch.setattr(priceguide, "can_replay", lambda *args: replayed.append(can_replay(*args)) or replayed[-1])
+    df, config = priceguide.recalculate(lg, 2022, hitters, pitchers, saved, changed_hitters=changed)
+
+    # The hitters' loop is replayed. Pitchers tie at a cutoff, so they start cold.
+    assert replayed[0]
+    assert json.dumps(config) == json.dumps(expected_config)
+
+    # Players tied on $ can come out in either order
+    by_player = ["mlbam_id", "pos", "$"]
+    df = df.sort_values(by_player).reset_index(drop=True)
+    expected = expected.sort_values(by_player).reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)
@@ -0,0 +1,110 @@
+import json
+
+import pandas as pd
+import pytest
+
+import priceguide
+import season_stats
+
+
+YEAR = 2030
+
+
+def split(player, stats, position=None):
+
+    record = {"player": {"id": player}, "stat": stats}
+    if position is not None:
+        record["position"] = {"abbreviation": position}
+
+    return record
+
+
+def hitter(player, **stats):
+
+    line = {field: 0 for field in season_stats.BATTING_STATS.values()}
+    line.update(stats)
+
+    return split(player, line)
+
+
+def pitcher(player, innings, **stats):
+
+    # statsapi sends innings as text, in baseball notation
+    line = {field: 0 for field in season_stats.PITCHING_STATS.values()}
+    line.update(stats, inningsPitched=innings)
+
+    return split(player, line)
+
+
+def record(path, splits):
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"stats": [{"splits": splits}]}))
+
+
+@pytest.fixture
+def recorded(tmp_path, monkeypatch):
+
+    # A small recorded season, served the way statsapi would
+    recorded_dir = tmp_path / "recorded"
+    record(season_stats.raw_path(recorded_dir, YEAR, "hitting"), [hitter(1, atBats=500, hits=150, homeRuns=30), hitter(2, atBats=400, hits=100)])
+    record(season_stats.raw_path(recorded_dir, YEAR, "pitching"), [pitcher(3, "6.2", strikeOuts=9), pitcher(4, "180.1", gamesStarted=30, wins=12)])
+    record(season_stats.raw_path(recorded_dir, YEAR, "fielding"), [
+        split(1, {"games": 140, "gamesStarted": 138}, "SS"),
+        split(2, {"games": 60, "gamesStarted": 50}, "LF"),
+        split(2, {"games": 30, "gamesStarted": 25}, "CF"),
+        split(2, {"games": 20, "gamesStarted": 10}, "RF"),
+        split(3, {"games": 40, "gamesStarted": 0}, "P"),
+        split(4, {"games": 30, "gamesStarted": 30}, "P"),
+    ])
+
+    monkeypatch.setattr(season_stats, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(season_stats, "GBP_DIR", tmp_path / "games_by_pos")
+    season_stats.DATA_DIR.mkdir()
+    season_stats.GBP_DIR.mkdir()
+
+    server = season_stats.serve_recorded(recorded_dir)
+    yield "http://127.0.0.1:" + str(server.server_port) + "/api/v1/stats"
+    server.shutdown()
+    server.server_close()
+    priceguide.invalidate_games_by_pos(YEAR)
+
+
+def test_build_range_from_recorded(tmp_path, recorded):
+
+    raw_dir = tmp_path / "raw"
+    season_stats.build_range([YEAR], concurrency=2, base_url=recorded, raw_dir=raw_dir)
+
+    assert sorted(path.name for path in raw_dir.iterdir()) == [str(YEAR) + "-fielding.json", str(YEAR) + "-hitting.json", str(YEAR) + "-pitching.json"]
+
+    hitters = priceguide.read_stats(season_stats.DATA_DIR / (str(YEAR) + "Batting.csv"))
+    assert hitters["mlbam_id"].tolist() == [1, 2]
+    assert hitters["HR"].tolist() == [30, 0]
+
+    # 6.2 innings are 6 and two thirds, so 20 outs
+    pitchers = priceguide.read_stats(season_stats.DATA_DIR / (str(YEAR) + "Pitching.csv"))
+    assert pitchers["OUTS"].tolist() == [20, 541]
+
+    gbp = pd.read_csv(season_stats.GBP_DIR / (str(YEAR) + ".csv"), index_col="mlbam_id")
+    assert gbp.loc[2, "OF"] == 110
+    assert gbp.loc[4, "SP"] == 30
+    assert gbp.loc[3, "RP"] == 40
+
+
+def test_build_range_resumes(tmp_path, recorded):
+
+    # A response already on disk isn't asked for again, and the rest are
+    raw_dir = tmp_path / "raw"
+    record(season_stats.raw_path(raw_dir, YEAR, "hitting"), [hitter(5, atBats=10, hits=3)])
+
+    season_stats.build_range([YEAR], base_url=recorded, raw_dir=raw_dir)
+
+    hitters = priceguide.read_stats(season_stats.DATA_DIR / (str(YEAR) + "Batting.csv"))
+    assert hitters["mlbam_id"].tolist() == [5]
+    pitchers = priceguide.read_stats(season_stats.DATA_DIR / (str(YEAR) + "Pitching.csv"))
+    assert pitchers["mlbam_id"].tolist() == [3, 4]
+
+    # Without resume, everything is fetched again
+    season_stats.build_range([YEAR], base_url=recorded, raw_dir=raw_dir, resume=False)
+    hitters = priceguide.read_stats(season_stats.DATA_DIR / (str(YEAR) + "Batting.csv"))
+    assert hitters["mlbam_id"].tolist() == [1, 2]
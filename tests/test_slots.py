@@ -0,0 +1,221 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+HITTING = ["C", "1B", "2B", "3B", "SS", "OF"]
+
+
+def random_players(rng, count, positions, most=2):
+
+    # Every hitter can also play Util
+    totals = rng.permutation(count).astype(float) + rng.random(count)
+    elig = np.full(count, priceguide.POSITION_BITS["Util"], dtype=np.int64)
+    for i in range(count):
+        for position in rng.choice(positions, rng.integers(1, most + 1), replace=False):
+            elig[i] |= priceguide.POSITION_BITS[position]
+
+    return totals, elig
+
+
+def random_slots(rng, flex):
+
+    slots = {position: int(rng.integers(1, 3)) for position in rng.choice(HITTING, 3, replace=False)}
+    for position in flex:
+        slots[position] = int(rng.integers(1, 3))
+
+    return slots
+
+
+def best_total(totals, elig, slots):
+
+    # Tries every way of putting players in slots
+    masks = [priceguide.position_mask(position) for position in slots]
+
+    def best(i, room):
+        if i == len(totals):
+            return 0.0
+        value = best(i + 1, room)
+        for t, mask in enumerate(masks):
+            if room[t] and elig[i] & mask:
+                value = max(value, totals[i] + best(i + 1, room[:t] + (room[t] - 1,) + room[t + 1:]))
+        return value
+
+    return best(0, tuple(slots.values()))
+
+
+def check_roster(totals, elig, slots, assigned):
+
+    positions = list(slots)
+    for i, slot in enumerate(assigned):
+        if slot >= 0:
+            assert elig[i] & priceguide.position_mask(positions[slot])
+    for t, position in enumerate(positions):
+        assert (assigned == t).sum() <= slots[position]
+
+    return totals[assigned >= 0].sum()
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_optimal_is_best_roster(seed):
+
+    rng = np.random.default_rng(seed)
+    totals, elig = random_players(rng, 8, ["1B", "2B", "3B", "SS"])
+    slots = random_slots(rng, ["MI", "CI", "Util"])
+
+    greedy, _ = priceguide.allocate_slots(totals, elig, slots)
+    optimal, _ = priceguide.allocate_optimal(totals, elig, slots)
+
+    best = best_total(totals, elig, slots)
+    assert check_roster(totals, elig, slots, optimal) == pytest.approx(best)
+    assert check_roster(totals, elig, slots, greedy) <= best + 1e-9
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_optimal_ignores_slot_order(seed):
+
+    rng = np.random.default_rng(seed)
+    totals, elig = random_players(rng, 40, HITTING, most=3)
+    slots = random_slots(rng, ["MI", "CI", "Util"])
+    assigned, repl = priceguide.allocate_optimal(totals, elig, slots)
+
+    positions = list(slots)
+    for shuffled in itertools.islice(itertools.permutations(positions), 1, 6):
+        other, other_repl = priceguide.allocate_optimal(totals, elig, {position: slots[position] for position in shuffled})
+        np.testing.assert_array_equal(assigned < 0, other < 0)
+        for i in np.flatnonzero(assigned >= 0):
+            assert positions[assigned[i]] == shuffled[other[i]]
+        assert other_repl.keys() == repl.keys()
+        for position in repl:
+            np.testing.assert_equal(other_repl[position], repl[position])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_fill_slots_ignores_player_rows(seed):
+
+    rng = np.random.default_rng(seed)
+    fits = rng.integers(1, 1 << 3, 30)
+    capacity = [2, 1, 3]
+    order = np.argsort(-rng.random(30), kind="stable")
+    members, _ = priceguide.fill_slots(order, fits, capacity)
+
+    # The same players in other rows fill the same slots
+    rows = rng.permutation(30)
+    moved = np.empty_like(fits)
+    moved[rows] = fits
+    other, _ = priceguide.fill_slots(rows[order], moved, capacity)
+    assert other == [[int(rows[player]) for player in taken] for taken in members]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_slots_hold_matches_matching(seed):
+
+    rng = np.random.default_rng(seed)
+    count = 3
+    capacity = [int(c) for c in rng.integers(0, 3, count)]
+    fits = [int(bits) for bits in rng.integers(1, 1 << count, rng.integers(1, 6))]
+
+    subsets = np.arange(1 << count)
+    room = np.zeros(1 << count, dtype=np.int64)
+    for t, slots in enumerate(capacity):
+        room += slots * (subsets >> t & 1)
+
+    # Counting players by the slots they fit loses the order they came in,
+    # so check against every order
+    players = np.zeros(1 << count, dtype=np.int64)
+    for bits in fits:
+        players[bits] += 1
+    holds = priceguide.slots_hold(players, room, count)
+
+    def fit(rest, left):
+        if not rest:
+            return True
+        return any(rest[0] >> t & 1 and left[t] and fit(rest[1:], left[:t] + [left[t] - 1] + left[t + 1:]) for t in range(count))
+
+    for shuffled in itertools.permutations(fits):
+        assert fit(list(shuffled), capacity) == holds
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_greedy_matches_optimal_without_flex(seed):
+
+    # With no flexible slots and one position per player, both solvers
+    # have only one roster to pick
+    rng = np.random.default_rng(seed)
+    totals, elig = random_players(rng, 60, HITTING, most=1)
+    elig &= ~priceguide.POSITION_BITS["Util"]
+    slots = random_slots(rng, [])
+
+    greedy, greedy_repl = priceguide.allocate_slots(totals, elig, slots)
+    optimal, optimal_repl = priceguide.allocate_optimal(totals, elig, slots)
+
+    np.testing.assert_array_equal(greedy, optimal)
+    assert greedy_repl.keys() == optimal_repl.keys()
+    for position in greedy_repl:
+        np.testing.assert_equal(greedy_repl[position], optimal_repl[position])
+
+
+def league_players():
+
+    # Ten hitters, best first, who can all play Util as well
+    positions = ["SS/2B", "2B", "C", "1B", "SS", "3B", "1B", "C", "2B", "OF"]
+    totals = np.arange(10, 0, -1).astype(float)
+    elig = priceguide.elig_from_pos(pd.Series(positions)) | priceguide.POSITION_BITS["Util"]
+
+    return totals, elig
+
+
+FLEX_SLOTS = {"C": 1, "2B": 1, "SS": 1, "1B": 1, "MI": 1, "CI": 1, "Util": 1}
+
+
+def test_allocate_slots_fills_positions_in_turn():
+
+    totals, elig = league_players()
+    assigned, repl = priceguide.allocate_slots(totals, elig, FLEX_SLOTS, np.arange(10))
+
+    # C, 2B, SS and 1B take the best player each, MI and CI the best left
+    # who fit, and Util whoever's next. MI and CI set the level for their
+    # positions, and Util for the positions of the player it took.
+    np.testing.assert_array_equal(assigned, [1, 4, 0, 3, 2, 5, 6, -1, -1, -1])
+    assert repl == {"C": 8, "2B": 9, "SS": 9, "1B": 4, "MI": 9, "CI": 5, "3B": 5, "Util": 4}
+
+
+def test_allocate_slots_follows_order():
+
+    # The second player is taken first, so he plays 2B and the first
+    # player moves over to SS
+    totals, elig = league_players()
+    order = np.array([1, 0, 2, 3, 4, 5, 6, 7, 8, 9])
+    assigned, repl = priceguide.allocate_slots(totals, elig, FLEX_SLOTS, order)
+
+    np.testing.assert_array_equal(assigned, [2, 1, 0, 3, 4, 5, 6, -1, -1, -1])
+    assert repl == {"C": 8, "2B": 6, "SS": 6, "1B": 4, "MI": 6, "CI": 5, "3B": 5, "Util": 4}
+
+
+def test_allocate_slots_short_position():
+
+    # A position without enough players is set by the worst of them, and
+    # one with nobody at all has no level
+    totals, elig = league_players()
+    assigned, repl = priceguide.allocate_slots(totals, elig, {"C": 3, "OF": 1, "RF": 1}, np.arange(10))
+
+    np.testing.assert_array_equal(assigned, [-1, -1, 0, -1, -1, -1, -1, 0, -1, 1])
+    assert repl["C"] == 3
+    assert repl["OF"] == 1
+    assert np.isnan(repl["RF"])
+
+
+def test_adjusted_totals_goes_deepest_last():
+
+    # Levels are applied from the highest down, so each player ends up
+    # against the lowest level among his positions, counting Util for
+    # everyone once it's reached
+    totals, elig = league_players()
+    repl = {"C": 8, "2B": 9, "SS": 9, "1B": 4, "MI": 9, "CI": 5, "3B": 5, "Util": 6}
+    adj_total = priceguide.adjusted_totals(totals, elig, repl)
+
+    np.testing.assert_array_equal(adj_total, totals - [6, 6, 6, 4, 6, 5, 4, 6, 6, 6])
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import priceguide
+
+
+@pytest.mark.parametrize("league", [priceguide.League.LEAGUE_STANDARD_5x5, priceguide.League.LEAGUE_CBS_POINTS])
+def test_stream_matches_calculate(tmp_path, season, league):
+
+    hitters, pitchers = season(2022)
+    hitters.to_csv(tmp_path / "hitters.csv", index=False)
+    pitchers.to_csv(tmp_path / "pitchers.csv", index=False)
+
+    expected, _ = priceguide.calculate(priceguide.League(league), 2022, hitters, pitchers)
+    priceguide.calculate_stream(priceguide.League(league), 2022, tmp_path / "hitters.csv", tmp_path / "pitchers.csv", tmp_path / "values.csv", chunk_size=50)
+    streamed = pd.read_csv(tmp_path / "values.csv")
+
+    assert list(streamed.columns) == list(expected.columns)
+    np.testing.assert_array_equal(streamed["$"].to_numpy(float), expected["$"].to_numpy(float))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["hitters.csv", "pitchers.csv", "values.csv"]
+
+
+def test_stream_parquet_round_trip(tmp_path, season):
+
+    pytest.importorskip("pyarrow")
+    hitters, pitchers = season(2022)
+    hitters.to_csv(tmp_path / "hitters.csv", index=False)
+    pitchers.to_csv(tmp_path / "pitchers.csv", index=False)
+    hitters.to_parquet(tmp_path / "hitters.parquet", index=False)
+    pitchers.to_parquet(tmp_path / "pitchers.parquet", index=False)
+
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    from_csv = priceguide.calculate_stream(lg, 2022, tmp_path / "hitters.csv", tmp_path / "pitchers.csv", tmp_path / "csv.csv", chunk_size=120)
+    from_parquet = priceguide.calculate_stream(lg, 2022, tmp_path / "hitters.parquet", tmp_path / "pitchers.parquet", tmp_path / "parquet.csv", chunk_size=120)
+
+    assert from_parquet["hitting"]["stream"] == from_csv["hitting"]["stream"]
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "parquet.csv"), pd.read_csv(tmp_path / "csv.csv"))
+
+
+def test_stream_reads_ip_the_same_in_every_chunk(tmp_path, season):
+
+    # One pitcher near the end of the file has decimal innings, so the
+    # whole file is decimal, even the chunks that look like notation
+    hitters, pitchers = season(2022)
+    pitchers.loc[len(pitchers) - 1, "IP"] = 10.5
+    hitters.to_csv(tmp_path / "hitters.csv", index=False)
+    pitchers.to_csv(tmp_path / "pitchers.csv", index=False)
+
+    lg = priceguide.League(priceguide.League.LEAGUE_STANDARD_5x5)
+    expected, _ = priceguide.calculate(lg, 2022, hitters, pitchers)
+    priceguide.calculate_stream(lg, 2022, tmp_path / "hitters.csv", tmp_path / "pitchers.csv", tmp_path / "values.csv", chunk_size=50)
+    streamed = pd.read_csv(tmp_path / "values.csv")
+
+    np.testing.assert_array_equal(streamed["$"].to_numpy(float), expected["$"].to_numpy(float))
+    np.testing.assert_array_equal(np.sort(streamed["IP"].dropna().to_numpy()), np.sort(expected["IP"].dropna().to_numpy(float)))